@@ -0,0 +1,2125 @@
+"""Headless scan, probe and convert pipeline shared by the GUI and the command-line tool.
+
+Nothing in this module imports tkinter. ConversionEngine reports what it is doing through
+an on_event callback that receives plain dicts, e.g. {"event": "log", "message": ...} or
+{"event": "progress", "finished": 3, "total": 10, "scanning": True}.
+"""
+
+import os
+import signal
+import subprocess
+from pathlib import Path
+import shutil
+import threading
+import json
+import queue
+import struct
+import hashlib
+import tempfile
+import time
+import math
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from dataclasses import dataclass, field
+import uuid
+from concurrent.futures import ThreadPoolExecutor, CancelledError, Future
+from mutagen import File
+from mutagen.id3 import ID3, ID3NoHeaderError
+import logging
+from logging.handlers import RotatingFileHandler
+
+LOG_DIR = Path.home() / ".audio_converter_logs"
+LOG_FILENAME = LOG_DIR / "audio_converter.log"
+TIMINGS_DIR = LOG_DIR / "timings"
+TIMING_FILES_KEPT = 20 # older per-run timing files are deleted
+CACHE_DIR = Path.home() / ".audio_converter_cache"
+JOURNAL_DIR = CACHE_DIR / "journals"
+ENCODE_SPEED_FILE = CACHE_DIR / "encode_speed.json" # measured per-job encode speed, used by plan()
+MIN_SPEED_SAMPLE_SECONDS = 60 # runs that encode less audio than this leave the measured speed alone
+PARTIAL_SUFFIX = ".audioconv-part" # track.flac is encoded as track.audioconv-part-<source hash>.flac, then renamed
+PROBE_CACHE_MAX_ENTRIES = 100000
+PROBE_CACHE_VERSION = 2
+AUDIO_EXTENSIONS = (".flac", ".mp3")
+WORK_QUEUE_FACTOR = 4 # queued jobs per worker before discovery waits
+WRITE_CHUNK_SIZE = 8 * 1024 * 1024 # staged outputs are copied to the target in chunks this large
+DEFAULT_FSYNC_BATCH = 8 # with staging, fsync the target after this many files (0 = leave it to the OS)
+PLAN_BATCH_SIZE = 500 # files probed per plan() task; per-file tasks cost more than a warm-cache probe
+WATCH_POLL_SECONDS = 15.0 # how often watch mode rescans the source tree
+WATCH_SETTLE_SECONDS = 10.0 # a new file must keep its size and mtime this long before it is converted
+DEFAULT_JOB_TIMEOUT = 300.0 # kill an encode that makes no progress for this many seconds (0 = never)
+WATCHDOG_INTERVAL = 1.0
+VERIFY_CACHE_MAX_ENTRIES = 100000
+VERIFY_CACHE_VERSION = 1
+VERIFY_DURATION_TOLERANCE = 0.5 # seconds an output may differ from its source (resampling, MP3 padding)
+PROGRESS_INTERVAL = 1.0 # seconds between progress events while nothing finishes
+INVALID_TAG_CHARS = '<>:"/\\|?*'
+SCHEDULES = ("discovery", "longest", "album") # job orders, see ConversionEngine.scheduled_files
+IONICE_CLASSES = {"best-effort": "2", "idle": "3"}
+
+def setup_logging(log_filename=LOG_FILENAME):
+    Path(log_filename).parent.mkdir(parents=True, exist_ok=True)
+    log_handler = RotatingFileHandler(
+        str(log_filename), # Use str() as RotatingFileHandler might not accept Path objects
+        maxBytes=10 * 1024 * 1024,
+        backupCount=5,
+    )
+    log_format = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    log_handler.setFormatter(log_format)
+
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+    logging.basicConfig(level=logging.DEBUG, handlers=[log_handler])
+
+def default_worker_count():
+    return os.cpu_count() or 1
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def format_bytes(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{num_bytes} B"
+        num_bytes /= 1024
+
+def priority_prefix(nice, ionice_class):
+    """Command prefix that runs a job at a lower CPU (nice) and disk (ionice) priority."""
+    prefix = []
+    if ionice_class:
+        if shutil.which("ionice"):
+            prefix += ["ionice", "-c", IONICE_CLASSES[ionice_class]]
+        else:
+            logging.warning("ionice not found; running encodes at normal disk priority")
+    if nice:
+        if shutil.which("nice"):
+            prefix += ["nice", "-n", str(nice)]
+        else:
+            logging.warning("nice not found; running encodes at normal CPU priority")
+    return prefix
+
+def clean_tag(value, default):
+    value = str(value) if value else default
+    for char in INVALID_TAG_CHARS:
+        value = value.replace(char, "")
+    return value.strip()
+
+def discover_audio_files(directory, recursive):
+    """Yield audio files as they are found, walking top-down with os.scandir like os.walk did."""
+    for entry in iter_audio_entries(directory, recursive):
+        yield Path(entry.path)
+
+def iter_audio_entries(directory, recursive):
+    """discover_audio_files, yielding the os.DirEntry objects (with their cached stat) instead."""
+    pending_dirs = [str(directory)]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as entries:
+                subdirs = []
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            if entry.name.lower().endswith(AUDIO_EXTENSIONS) and not is_partial_output(entry.name):
+                                yield entry
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                    except OSError as e:
+                        logging.warning(f"Skipping unreadable entry {entry.path}: {e}")
+        except OSError as e:
+            logging.warning(f"Cannot scan directory {current_dir}: {e}")
+            continue
+        pending_dirs.extend(reversed(subdirs))
+
+def make_run_temp_dir(prefix, parent=None):
+    """mkdtemp named prefix<pid>_..., after removing dirs with that prefix left by dead processes.
+
+    Staged encodes and converted artwork live in such dirs, often on tmpfs; a crashed run never
+    reaches its cleanup, so the next run sweeps them. Dirs of converters still running are kept.
+    """
+    parent = parent or tempfile.gettempdir()
+    try:
+        entries = [entry for entry in os.scandir(parent) if entry.name.startswith(prefix)]
+    except OSError as e:
+        logging.warning(f"Cannot scan {parent} for stale {prefix}* dirs: {e}")
+        entries = []
+    for entry in entries:
+        pid = entry.name[len(prefix):].partition("_")[0]
+        if pid.isdigit() and not process_alive(int(pid)) and entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+            logging.info(f"Removed temp dir left by an interrupted run: {entry.path}")
+    return Path(tempfile.mkdtemp(prefix=f"{prefix}{os.getpid()}_", dir=parent))
+
+def process_alive(pid):
+    if os.name == "nt":
+        return True  # os.kill(pid, 0) would terminate the process on Windows; never sweep there
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, owned by another user
+    return True
+
+def partial_output_path(output_file, source_file):
+    """The name output_file is written under until complete; unique per source, so jobs never share one."""
+    source_hash = hashlib.sha1(os.path.abspath(source_file).encode("utf-8", "surrogateescape")).hexdigest()[:8]
+    return output_file.with_name(f"{output_file.stem}{PARTIAL_SUFFIX}-{source_hash}{output_file.suffix}")
+
+def is_partial_output(file_name):
+    stem = os.path.splitext(file_name)[0]
+    marker, _, source_hash = stem.rpartition("-")
+    return marker.endswith(PARTIAL_SUFFIX) and len(source_hash) == 8 and all(c in "0123456789abcdef" for c in source_hash)
+
+def iter_flac_blocks(f):
+    """Yield (block_type, block_length) for each FLAC metadata block of an open file.
+
+    The file is positioned at the start of the block's data on each yield; blocks the
+    caller does not read are skipped with a seek. Yields nothing if f is not a FLAC stream.
+    """
+    marker = f.read(4)
+    if marker[:3] == b"ID3":
+        # Some taggers put an ID3v2 block in front of the FLAC marker; its size is syncsafe
+        header = marker + f.read(6)
+        if len(header) < 10:
+            return
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        f.seek(10 + size)
+        marker = f.read(4)
+    if marker != b"fLaC":
+        return
+
+    is_last = False
+    while not is_last:
+        block_header = f.read(4)
+        if len(block_header) < 4:
+            return
+        is_last = bool(block_header[0] & 0x80)
+        block_type = block_header[0] & 0x7F
+        block_length = int.from_bytes(block_header[1:4], "big")
+        block_end = f.tell() + block_length
+        yield block_type, block_length
+        f.seek(block_end)
+
+def read_flac_header(file_path):
+    """Parse STREAMINFO and VORBIS_COMMENT from a FLAC file without touching the audio frames.
+
+    Returns a dict with bits_per_sample, sample_rate, channels, duration, md5, artist,
+    album and has_picture, or None if the file is not a FLAC stream this parser understands.
+    """
+    info = None
+    tags = {}
+    has_picture = False
+    with open(file_path, "rb") as f:
+        for block_type, block_length in iter_flac_blocks(f):
+            if block_type == 0:  # STREAMINFO
+                data = f.read(block_length)
+                if len(data) < 34:
+                    return None
+                packed = int.from_bytes(data[10:18], "big")
+                sample_rate = packed >> 44
+                channels = ((packed >> 41) & 0x07) + 1
+                bits_per_sample = ((packed >> 36) & 0x1F) + 1
+                total_samples = packed & 0xFFFFFFFFF
+                info = {
+                    "bits_per_sample": bits_per_sample,
+                    "sample_rate": sample_rate,
+                    "channels": channels,
+                    "duration": total_samples / sample_rate if sample_rate else None,
+                    "md5": data[18:34].hex(),
+                }
+            elif block_type == 4:  # VORBIS_COMMENT, little-endian lengths unlike the rest of FLAC
+                data = f.read(block_length)
+                vendor_length = struct.unpack_from("<I", data, 0)[0]
+                offset = 4 + vendor_length
+                count = struct.unpack_from("<I", data, offset)[0]
+                offset += 4
+                for _ in range(count):
+                    length = struct.unpack_from("<I", data, offset)[0]
+                    offset += 4
+                    if offset + length > len(data):
+                        # A cut-off block would give half a tag; fail like the other short reads so probing falls back
+                        raise struct.error("VORBIS_COMMENT entry runs past the end of the block")
+                    comment = data[offset:offset + length].decode("utf-8", errors="replace")
+                    offset += length
+                    key, sep, value = comment.partition("=")
+                    if sep:
+                        tags.setdefault(key.lower(), value)
+            elif block_type == 6:  # PICTURE
+                has_picture = True
+
+    if info is None:
+        return None
+    info["artist"] = tags.get("artist")
+    info["album"] = tags.get("album")
+    info["has_picture"] = has_picture
+    return info
+
+def read_flac_picture(file_path):
+    """Return the image bytes of the front cover (or else the first) PICTURE block, or None."""
+    first_picture = None
+    with open(file_path, "rb") as f:
+        for block_type, block_length in iter_flac_blocks(f):
+            if block_type != 6:
+                continue
+            data = f.read(block_length)
+            picture_type = struct.unpack_from(">I", data, 0)[0]
+            offset = 4
+            mime_length = struct.unpack_from(">I", data, offset)[0]
+            offset += 4 + mime_length
+            description_length = struct.unpack_from(">I", data, offset)[0]
+            offset += 4 + description_length + 16  # width, height, colour depth, indexed colours
+            data_length = struct.unpack_from(">I", data, offset)[0]
+            offset += 4
+            picture = data[offset:offset + data_length]
+            if picture_type == 3:
+                return picture
+            if first_picture is None:
+                first_picture = picture
+    return first_picture
+
+def read_embedded_picture(file_path):
+    if file_path.suffix.lower() == ".flac":
+        return read_flac_picture(file_path)
+    try:
+        tags = ID3(file_path)
+    except ID3NoHeaderError:
+        return None
+    pictures = tags.getall("APIC")
+    for picture in pictures:
+        if picture.type == 3:
+            return picture.data
+    return pictures[0].data if pictures else None
+
+def audio_signature(file_path):
+    """Identify sources that would encode to identical outputs.
+
+    FLAC uses the STREAMINFO MD5 of the decoded audio plus a hash of the stream layout,
+    tags and pictures ffmpeg carries over, so retagged copies are not merged. MP3s and
+    FLACs written without an MD5 fall back to a hash of the whole file.
+    """
+    if file_path.suffix.lower() == ".flac":
+        digest = hashlib.sha1()
+        audio_md5 = None
+        with open(file_path, "rb") as f:
+            for block_type, block_length in iter_flac_blocks(f):
+                if block_type == 0:  # STREAMINFO: sample rate, channels, bits, samples, MD5
+                    data = f.read(block_length)
+                    digest.update(data[10:18])
+                    audio_md5 = data[18:34]
+                elif block_type in (4, 6):  # VORBIS_COMMENT, PICTURE
+                    digest.update(bytes([block_type]))
+                    digest.update(f.read(block_length))
+        if audio_md5 and any(audio_md5):
+            return f"flac-md5:{audio_md5.hex()}:{digest.hexdigest()}"
+
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(WRITE_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return f"sha1:{digest.hexdigest()}"
+
+def estimate_output_bytes(probe, source_size, output_format, bitrate):
+    """Rough output size: MP3 from the bitrate, FLAC-16 at the source's own compression ratio."""
+    duration = probe["duration"] or 0.0
+    if output_format == "mp3":
+        return int(duration * bitrate * 1000 / 8)
+    channels = probe["channels"] or 2
+    source_pcm_bytes = duration * (probe["sample_rate"] or 44100) * channels * probe["bit_depth"] / 8
+    ratio = min(1.0, source_size / source_pcm_bytes) if source_pcm_bytes else 1.0
+    return int(duration * 44100 * channels * 2 * ratio)
+
+def load_encode_speeds():
+    """{output_format: {"realtime": seconds of audio per encode second, "measured": timestamp}}"""
+    try:
+        with open(ENCODE_SPEED_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable encode speed file {ENCODE_SPEED_FILE}: {e}")
+        return {}
+
+def save_encode_speed(output_format, realtime):
+    speeds = load_encode_speeds()
+    speeds[output_format] = {"realtime": round(realtime, 2), "measured": datetime.now().isoformat(timespec="seconds")}
+    try:
+        ENCODE_SPEED_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = ENCODE_SPEED_FILE.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(speeds, f)
+        os.replace(tmp_file, ENCODE_SPEED_FILE)
+    except OSError as e:
+        logging.error(f"Error saving encode speed file {ENCODE_SPEED_FILE}: {e}")
+
+class StatCache:
+    """JSON file cache of per-file values, valid only while the file's size, mtime and inode are unchanged."""
+
+    def __init__(self, cache_file, max_entries, version=1):
+        self.cache_file = Path(cache_file)
+        self.max_entries = max_entries
+        self.version = version
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def file_signature(file_path):
+        st = os.stat(file_path)
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def get(self, file_path):
+        key = os.path.abspath(file_path)
+        try:
+            signature = self.file_signature(key)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry["sig"] != signature:
+                self.dirty = True
+                return None
+            self.entries[key] = entry  # re-insert so eviction drops least recently used entries first
+            return entry["value"]
+
+    def put(self, file_path, value):
+        key = os.path.abspath(file_path)
+        try:
+            signature = self.file_signature(key)
+        except OSError:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = {"sig": signature, "value": value}
+            self.dirty = True
+
+    def invalidate(self, file_path):
+        with self.lock:
+            if self.entries.pop(os.path.abspath(file_path), None) is not None:
+                self.dirty = True
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.dirty = True
+        self.save()
+
+    def load(self):
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self.entries = data.get("entries", {})
+            logging.debug(f"Loaded {len(self.entries)} cache entries from {self.cache_file}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable cache file {self.cache_file}: {e}")
+            self.entries = {}
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            excess = len(self.entries) - self.max_entries
+            if excess > 0:
+                for key in list(self.entries)[:excess]:
+                    del self.entries[key]
+            data = {"version": self.version, "entries": self.entries}
+            self.dirty = False
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.cache_file.with_suffix(".tmp")
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.cache_file)
+            logging.debug(f"Saved {len(data['entries'])} cache entries to {self.cache_file}")
+        except OSError as e:
+            logging.error(f"Error saving cache file {self.cache_file}: {e}")
+
+class RunJournal:
+    """Append-only JSON-lines record of job states for one set of run options.
+
+    Each line is {"source", "state", "output"} where state is pending, encoding, done or failed;
+    the last line for a source wins. A run that finishes deletes its journal, so an existing
+    journal means the previous run with the same options was interrupted.
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = Path(journal_file)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.load()
+        self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+        self.handle = open(self.journal_file, "a", encoding="utf-8")
+
+    @classmethod
+    def for_run(cls, run_options):
+        run_key = hashlib.sha1(json.dumps(run_options, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        return cls(JOURNAL_DIR / f"run-{run_key}.jsonl")
+
+    def load(self):
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.jobs[record["source"]] = record
+                    except (ValueError, KeyError):
+                        continue  # a crash can leave a truncated last line
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Ignoring unreadable journal {self.journal_file}: {e}")
+
+    def record(self, source, state, output=None):
+        record = {"source": str(source), "state": state, "output": str(output) if output else None}
+        with self.lock:
+            self.jobs[record["source"]] = record
+            self.handle.write(json.dumps(record) + "\n")
+            self.handle.flush()
+
+    def remove_partial_outputs(self):
+        """Delete .part files left by jobs that were still encoding when the last run died."""
+        removed = 0
+        for record in list(self.jobs.values()):
+            if record["state"] != "encoding" or not record["output"]:
+                continue
+            partial_file = partial_output_path(Path(record["output"]), record["source"])
+            try:
+                os.remove(partial_file)
+                removed += 1
+                logging.info(f"Removed half-written output from interrupted run: {partial_file}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Error removing half-written output {partial_file}: {e}")
+        return removed
+
+    def close(self, finished):
+        with self.lock:
+            self.handle.close()
+        if finished:
+            try:
+                os.remove(self.journal_file)
+            except OSError as e:
+                logging.error(f"Error removing journal {self.journal_file}: {e}")
+
+class ArtworkCache:
+    """Per-run temp directory of cover images, converted to baseline JPEG once per distinct picture.
+
+    Pictures are keyed by a hash of their bytes, so every track of an album shares one
+    converted file. A lock per hash makes concurrent workers wait for the first conversion.
+    """
+
+    def __init__(self):
+        self.directory = make_run_temp_dir("audio_converter_art_")
+        self.entries = {}
+        self.hash_locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, picture_data):
+        digest = hashlib.sha1(picture_data).hexdigest()
+        with self.lock:
+            hash_lock = self.hash_locks.setdefault(digest, threading.Lock())
+        with hash_lock:
+            if digest not in self.entries:
+                self.entries[digest] = self.convert(digest, picture_data)
+            return self.entries[digest]
+
+    def convert(self, digest, picture_data):
+        source_image = self.directory / f"{digest}.src"
+        artwork = self.directory / f"{digest}.jpg"
+        try:
+            source_image.write_bytes(picture_data)
+            artwork_cmd = ["ffmpeg", "-y", "-i", str(source_image), "-an", "-vcodec", "mjpeg",
+                           "-vf", "format=yuv420p", "-f", "image2", str(artwork)]
+            logging.debug(f"Artwork conversion command: {' '.join(artwork_cmd)}")
+            artwork_result = subprocess.run(artwork_cmd, capture_output=True, text=True)
+            logging.debug(f"Artwork conversion return code: {artwork_result.returncode}")
+            if artwork_result.returncode == 0 and artwork.exists() and artwork.stat().st_size > 0:
+                return artwork
+            logging.warning(f"Failed to convert artwork {digest}: {artwork_result.stderr.strip()}")
+            return None
+        finally:
+            try:
+                os.remove(source_image)
+            except OSError:
+                pass
+
+    def extract_with_ffmpeg(self, file_path):
+        """Fallback for files whose embedded picture could not be read in-process."""
+        extracted = self.directory / f"extract-{threading.get_ident()}.jpg"
+        artwork_cmd = ["ffmpeg", "-y", "-i", str(file_path), "-an", "-vcodec", "mjpeg",
+                       "-vf", "format=yuv420p", "-f", "image2", str(extracted)]
+        logging.debug(f"Artwork extraction command: {' '.join(artwork_cmd)}")
+        artwork_result = subprocess.run(artwork_cmd, capture_output=True, text=True)
+        try:
+            if artwork_result.returncode == 0 and extracted.exists() and extracted.stat().st_size > 0:
+                return self.get(extracted.read_bytes())
+            logging.warning(f"No artwork or failed to extract artwork for {file_path.name}. Output: {artwork_result.stderr.strip()}")
+            return None
+        finally:
+            try:
+                os.remove(extracted)
+            except OSError:
+                pass
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class RunTimings:
+    """Per-file, per-stage timing records for one run.
+
+    Records are {"file", "stage", "seconds", "bytes_read", "bytes_written"} and are also appended
+    as JSON lines to timings_file when one is given, so slow runs can be analysed afterwards.
+    """
+
+    def __init__(self, timings_file=None):
+        self.timings_file = Path(timings_file) if timings_file else None
+        self.records = []
+        self.recorded_once = set()
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.handle = None
+        if self.timings_file:
+            self.timings_file.parent.mkdir(parents=True, exist_ok=True)
+            self.handle = open(self.timings_file, "a", encoding="utf-8")
+
+    @classmethod
+    def for_new_run(cls):
+        TIMINGS_DIR.mkdir(parents=True, exist_ok=True)
+        old_files = sorted(TIMINGS_DIR.glob("run-*.jsonl"))
+        for old_file in old_files[:max(0, len(old_files) - TIMING_FILES_KEPT + 1)]:
+            try:
+                os.remove(old_file)
+            except OSError as e:
+                logging.warning(f"Error removing old timing file {old_file}: {e}")
+        return cls(TIMINGS_DIR / f"run-{datetime.now():%Y%m%d-%H%M%S-%f}.jsonl")
+
+    @contextmanager
+    def stage(self, file_path, stage):
+        """Time a block; the yielded record can be given bytes_read/bytes_written by the caller."""
+        record = {"file": str(file_path), "stage": stage, "bytes_read": 0, "bytes_written": 0}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            with self.lock:
+                self.records.append(record)
+                if self.handle:
+                    self.handle.write(json.dumps(record) + "\n")
+
+    def stage_once(self, file_path, stage):
+        """Like stage(), but only the first call per file is recorded, for lookups repeated during a run."""
+        key = (str(file_path), stage)
+        with self.lock:
+            first = key not in self.recorded_once
+            self.recorded_once.add(key)
+        return self.stage(file_path, stage) if first else nullcontext({})
+
+    def summary(self, slowest_count=5):
+        with self.lock:
+            records = list(self.records)
+        wall_seconds = time.monotonic() - self.started_at
+        stages = {}
+        per_file = {}
+        bytes_read = 0
+        bytes_written = 0
+        for record in records:
+            stages.setdefault(record["stage"], []).append(record["seconds"])
+            per_file[record["file"]] = per_file.get(record["file"], 0.0) + record["seconds"]
+            bytes_read += record["bytes_read"]
+            bytes_written += record["bytes_written"]
+        slowest = sorted(per_file.items(), key=lambda item: item[1], reverse=True)[:slowest_count]
+        return {
+            "wall_seconds": round(wall_seconds, 3),
+            "stages": {
+                name: {
+                    "count": len(values),
+                    "total": round(sum(values), 3),
+                    "p50": round(percentile(values, 0.50), 3),
+                    "p95": round(percentile(values, 0.95), 3),
+                }
+                for name, values in stages.items()
+            },
+            "slowest_files": [{"file": path, "seconds": round(seconds, 3)} for path, seconds in slowest],
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            "read_bytes_per_second": round(bytes_read / wall_seconds) if wall_seconds else 0,
+            "write_bytes_per_second": round(bytes_written / wall_seconds) if wall_seconds else 0,
+        }
+
+    @staticmethod
+    def format_summary(summary):
+        lines = ["Performance report:", f"{'Stage':<16}{'Count':>7}{'Total s':>10}{'p50 s':>9}{'p95 s':>9}"]
+        for name, stats in sorted(summary["stages"].items(), key=lambda item: item[1]["total"], reverse=True):
+            lines.append(f"{name:<16}{stats['count']:>7}{stats['total']:>10.2f}{stats['p50']:>9.3f}{stats['p95']:>9.3f}")
+        mb = 1024 * 1024
+        lines.append(
+            f"Wall time {summary['wall_seconds']:.1f}s, read {summary['bytes_read'] / mb:.1f} MB"
+            f" ({summary['read_bytes_per_second'] / mb:.1f} MB/s), wrote {summary['bytes_written'] / mb:.1f} MB"
+            f" ({summary['write_bytes_per_second'] / mb:.1f} MB/s)"
+        )
+        if summary["slowest_files"]:
+            lines.append("Slowest files:")
+            for entry in summary["slowest_files"]:
+                lines.append(f"  {entry['seconds']:>8.2f}s  {entry['file']}")
+        return lines
+
+    def close(self):
+        summary = self.summary()
+        with self.lock:
+            if self.handle:
+                self.handle.write(json.dumps({"summary": summary}) + "\n")
+                self.handle.close()
+                self.handle = None
+
+class StagedWriter:
+    """Copies finished encodes from a local staging directory to slow target media.
+
+    ffmpeg writes many small pieces, and parallel encodes interleave them. With staging, ffmpeg
+    writes to fast local disk or tmpfs, and only this writer touches the target. It uses
+    write_workers threads (1 = strictly sequential), each copying a whole file in
+    WRITE_CHUNK_SIZE writes to a .part name and renaming it into place. fsync_batch controls
+    durability: 0 leaves flushing to the OS, 1 syncs every file before its rename, and N syncs
+    the last N files (and their directories) together.
+    """
+
+    def __init__(self, staging_dir, write_workers=1, fsync_batch=DEFAULT_FSYNC_BATCH):
+        self.staging_dir = make_run_temp_dir("audio_converter_stage_", staging_dir or None)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, write_workers), thread_name_prefix="writer")
+        self.fsync_batch = max(0, fsync_batch)
+        self.unsynced = []
+        self.lock = threading.Lock()
+
+    def staged_path(self, output_file):
+        # Unique name, same extension so ffmpeg still picks the right muxer
+        return self.staging_dir / f"{uuid.uuid4().hex}{output_file.suffix}"
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def copy_into_place(self, staged_file, output_file, partial_file, durable=False, replace=True):
+        """Copy staged_file to output_file via partial_file; returns the bytes written. durable forces an fsync now.
+
+        With replace=False the copy is left at partial_file for the caller to rename.
+        """
+        sync_now = durable or self.fsync_batch == 1
+        written = 0
+        with open(staged_file, "rb") as src, open(partial_file, "wb") as dst:
+            while True:
+                chunk = src.read(WRITE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                written += len(chunk)
+            if sync_now:
+                dst.flush()
+                os.fsync(dst.fileno())
+        if replace:
+            os.replace(partial_file, output_file)
+        else:
+            output_file = partial_file
+        os.remove(staged_file)
+
+        if sync_now:
+            self.sync_paths([output_file], files=False)
+        elif self.fsync_batch:
+            batch = None
+            with self.lock:
+                self.unsynced.append(output_file)
+                if len(self.unsynced) >= self.fsync_batch:
+                    batch, self.unsynced = self.unsynced, []
+            if batch:
+                self.sync_paths(batch)
+        return written
+
+    def sync_paths(self, paths, files=True):
+        targets = list(paths) if files else []
+        targets += sorted({str(Path(path).parent) for path in paths})
+        for target in targets:
+            try:
+                fd = os.open(target, os.O_RDONLY)
+            except OSError:
+                continue  # directories cannot be opened on Windows
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logging.warning(f"fsync failed for {target}: {e}")
+            finally:
+                os.close(fd)
+
+    def cancel(self):
+        """Drop queued copies on a stop; the ones already running finish and close() waits for them."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            batch, self.unsynced = self.unsynced, []
+        if batch:
+            self.sync_paths(batch)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+class FolderWatcher:
+    """Find new or changed audio files by diffing os.scandir snapshots; no inotify or other services.
+
+    A file is reported once its size and mtime have stayed the same for settle_seconds, so
+    albums that are still being copied or downloaded are not converted half-written.
+    """
+
+    def __init__(self, directory, recursive, settle_seconds=WATCH_SETTLE_SECONDS):
+        self.directory = os.path.abspath(directory)
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self.known = {}  # path -> (size, mtime_ns) already handled or present at start
+        self.pending = {}  # path -> ((size, mtime_ns), when it was first seen like that)
+
+    def snapshot(self):
+        snapshot = {}
+        for entry in iter_audio_entries(self.directory, self.recursive):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue  # removed between the scandir and the stat
+            snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def start(self):
+        """Take the first snapshot; returns the files that can be converted right away, in walk order.
+
+        Files modified within settle_seconds may still be arriving, so they are held back in
+        pending and reported by poll() once they have stopped growing.
+        """
+        now = time.monotonic()
+        cutoff_ns = time.time_ns() - int(self.settle_seconds * 1000000000)
+        self.known = {}
+        self.pending = {}
+        for path, signature in self.snapshot().items():
+            if signature[1] > cutoff_ns:
+                self.pending[path] = (signature, now)
+            else:
+                self.known[path] = signature
+        return [Path(path) for path in self.known]
+
+    def poll(self):
+        """Rescan; returns the new or changed files that have stopped growing since the last polls."""
+        now = time.monotonic()
+        current = self.snapshot()
+        ready = []
+        for path, signature in current.items():
+            if self.known.get(path) == signature:
+                continue
+            pending = self.pending.get(path)
+            if pending is None or pending[0] != signature:
+                self.pending[path] = (signature, now)  # new, or still being written
+            elif now - pending[1] >= self.settle_seconds:
+                del self.pending[path]
+                self.known[path] = signature
+                ready.append(Path(path))
+        for table in (self.known, self.pending):
+            for path in [path for path in table if path not in current]:
+                del table[path]
+        return sorted(ready)
+
+    def mark_seen(self, paths):
+        """Record files written by the converter itself so they are not reported as new."""
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            path = os.path.abspath(path)
+            self.known[path] = (st.st_size, st.st_mtime_ns)
+            self.pending.pop(path, None)
+
+@dataclass
+class ConversionOptions:
+    directory: Path
+    output_format: str = "flac"
+    bitrate: int = 320
+    recursive: bool = False
+    delete_source: bool = False
+    delete_cue: bool = False
+    output_subdir: str = ""
+    workers: int = field(default_factory=default_worker_count)
+    staging_dir: str = "" # empty = ffmpeg writes straight to the target
+    write_workers: int = 1
+    fsync_batch: int = DEFAULT_FSYNC_BATCH
+    deduplicate: bool = True # encode identical sources once and copy the output to the others
+    schedule: str = "discovery" # one of SCHEDULES; the others probe the whole tree before the first encode
+    nice: int = 0 # niceness added to each ffmpeg job, 0-19
+    ionice_class: str = "" # "", "best-effort" or "idle" disk priority for each ffmpeg job
+    job_timeout: float = DEFAULT_JOB_TIMEOUT # seconds without encode progress before the watchdog kills a job
+    verify: bool = False # decode-test every output before its source may be deleted
+    verify_workers: int = 1
+
+class ConversionEngine:
+    def __init__(self, options, on_event=None, probe_cache=None, verify_cache=None):
+        self.options = options
+        self.on_event = on_event
+        self.probe_cache = probe_cache or StatCache(CACHE_DIR / "probe_cache.json", PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_VERSION)
+        self.verify_cache = verify_cache  # loaded on first use, only verified runs need it
+        self.verifier = None
+        # Probes that failed are not cached on disk, so later runs retry them; this keeps a run
+        # from probing (and logging) the same unreadable file again. path -> (stat signature, probe)
+        self.failed_probes_lock = threading.Lock()
+        self.failed_probes = {}
+        self.running = False
+        self.stop_requested = False
+        self.watching = False
+        self.state_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # Running ffmpeg jobs by pid, so stop() and the watchdog can kill them
+        self.process_lock = threading.Lock()
+        self.processes = {}
+        self.journal = None
+        self.artwork_cache = None
+        self.writer = None
+        self.job_prefix = []
+        self.ffprobe_available = None
+        # Seconds of source audio, used for duration-weighted progress and ETA
+        self.progress_lock = threading.Lock()
+        self.audio_total = 0.0
+        self.audio_done = 0.0
+        self.audio_active = {}
+        self.encode_time_done = 0.0
+        self.started_at = None
+        # Duplicate detection: output of each finished source and what encoding it cost
+        self.dedupe_lock = threading.Lock()
+        self.job_outputs = {}
+        self.encode_seconds = {}
+        self.dedupe_saved = 0.0
+        # Output path -> the source that produced it, for the engine's lifetime. Different sources
+        # can map to one output (e.g. Disc 1/01.flac and Disc 2/01.flac of the same album).
+        self.claims_lock = threading.Lock()
+        self.output_claims = {}
+        # In-memory only until run() starts a recorded run; lets probe calls be timed standalone too
+        self.timings = RunTimings()
+
+    def emit(self, event, **fields):
+        if self.on_event is not None:
+            self.on_event({"event": event, **fields})
+
+    def log(self, message):
+        self.emit("log", message=message)
+        logging.info(message)
+
+    def stop(self):
+        """Cancel now: queued jobs are dropped and running ffmpeg process groups are killed.
+
+        Safe to call from any thread and before run() has started; an engine is not reused after a stop.
+        """
+        with self.state_lock:
+            already_stopping = self.stop_requested
+            self.running = False
+            self.stop_requested = True
+        self.stop_event.set()
+        self.kill_jobs()
+        if not already_stopping:
+            self.log("Stopping conversion...")
+
+    def begin_run(self):
+        """Mark a run as started; False if stop() was called before it could start."""
+        with self.state_lock:
+            if self.stop_requested:
+                return False
+            self.running = True
+            return True
+
+    def kill_jobs(self):
+        with self.process_lock:
+            jobs = list(self.processes.values())
+        for job in jobs:
+            self.kill_process_group(job["process"])
+
+    @staticmethod
+    def kill_process_group(process):
+        # ffmpeg runs in its own session, so this also takes nice/ionice wrappers and any children
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError:
+            pass  # already exited
+
+    def watchdog(self, done):
+        """Kill encodes that have made no progress for options.job_timeout seconds."""
+        timeout = self.options.job_timeout
+        while not done.wait(WATCHDOG_INTERVAL):
+            now = time.monotonic()
+            with self.process_lock:
+                stalled = [job for job in self.processes.values()
+                           if not job["timed_out"] and now - job["last_progress"] > timeout]
+                for job in stalled:
+                    job["timed_out"] = True
+            for job in stalled:
+                self.log(f"Killing ffmpeg for {job['file'].name}: no progress for {timeout:.0f}s")
+                self.kill_process_group(job["process"])
+
+    def run(self, files=None):
+        """Convert everything under options.directory, or just files; returns the per-status job counts."""
+        results = {"converted": 0, "copied": 0, "skipped": 0, "failed": 0, "stopped": 0}
+        if not self.begin_run():
+            return results
+        self.log("Starting conversion...")
+        options = self.options
+        directory = Path(options.directory)
+        output_format = options.output_format
+        delete_source = options.delete_source
+        delete_cue = options.delete_cue
+        recursive = options.recursive
+
+        if not directory.exists():
+            self.log("Invalid directory.")
+            self.finish(results)
+            return results
+
+        self.journal = RunJournal.for_run({
+            "directory": os.path.abspath(directory),
+            "format": output_format,
+            "bitrate": options.bitrate if output_format == "mp3" else None,
+            "recursive": recursive,
+            "delete_source": delete_source,
+            "output_subdir": "" if delete_source else options.output_subdir,
+        })
+        if self.journal.jobs:
+            removed = self.journal.remove_partial_outputs()
+            self.log(f"Resuming interrupted run ({len(self.journal.jobs)} journaled jobs, {removed} half-written outputs removed).")
+
+        if output_format == "mp3":
+            self.artwork_cache = ArtworkCache()
+        if options.staging_dir:
+            self.writer = StagedWriter(options.staging_dir, options.write_workers, options.fsync_batch)
+            logging.debug(f"Staging encodes in {self.writer.staging_dir}")
+        if options.verify:
+            if self.verify_cache is None:
+                self.verify_cache = StatCache(CACHE_DIR / "verify_cache.json", VERIFY_CACHE_MAX_ENTRIES, VERIFY_CACHE_VERSION)
+            self.verifier = ThreadPoolExecutor(max_workers=max(1, options.verify_workers), thread_name_prefix="verify")
+
+        num_workers = max(1, int(options.workers))
+        logging.debug(f"Converting with {num_workers} worker(s), {options.schedule} order")
+        self.job_prefix = priority_prefix(options.nice, options.ionice_class)
+        self.timings = RunTimings.for_new_run()
+        self.audio_total = 0.0
+        self.audio_done = 0.0
+        self.audio_active = {}
+        self.encode_time_done = 0.0
+        self.started_at = time.monotonic()
+        self.job_outputs = {}
+        self.encode_seconds = {}
+        self.dedupe_saved = 0.0
+
+        # Discovery feeds a bounded work queue so walking a slow card overlaps with converting.
+        # Each job runs convert_audio plus its own .cue cleanup, so nothing depends on completion order.
+        total_files = 0
+        finished_files = 0
+        scanning = True
+        last_progress = 0.0
+        done_queue = queue.Queue()
+        slots = threading.BoundedSemaphore(num_workers * WORK_QUEUE_FACTOR)
+
+        def job_done(future, file_path, job_seconds):
+            if not future.cancelled() and future.exception() is None and isinstance(future.result(), Future):
+                # Encoded into the staging area; the job is finished once the writer has copied it
+                future.result().add_done_callback(lambda f: job_done(f, file_path, job_seconds))
+                return
+            slots.release()
+            done_queue.put((file_path, future, job_seconds))
+
+        # Only sources whose probed duration matches an earlier source's can be duplicates. Those are
+        # hashed in their worker, not here, and compared with the earlier ones; a match waits for the
+        # first identical source to be encoded and then reuses its output, holding a work slot but
+        # not a worker while it waits. With delete-source a file may be the first of its duration
+        # and still have to be hashed, before its own job removes the source a later copy is compared with.
+        same_duration = {}
+        signatures = {}
+
+        def when_finished(future, callback):
+            def resolved(f):
+                if f.cancelled():
+                    callback("stopped")
+                elif f.exception() is not None:
+                    callback("failed")
+                elif isinstance(f.result(), Future):
+                    when_finished(f.result(), callback)
+                else:
+                    callback(f.result())
+            future.add_done_callback(resolved)
+
+        def start_duplicate(future, file_path, leader_path):
+            # Checked first: cancelled leaders call back from inside executor.shutdown, where submit would deadlock
+            if not self.running:
+                future.set_result("stopped")
+                return
+            try:
+                future.set_result(executor.submit(
+                    self.duplicate_job, file_path, leader_path, output_format, delete_source, delete_cue, directory
+                ))
+            except RuntimeError:  # executor already shut down by a stop
+                future.set_result("stopped")
+
+        def signature_of(file_path):
+            if str(file_path) not in signatures:
+                signatures[str(file_path)] = self.job_signature(file_path)
+            return signatures[str(file_path)]
+
+        def dedupe_job(file_path, earlier):
+            if not self.running:
+                return "stopped"
+            signature = signature_of(file_path)
+            for leader_path, leader_future in (earlier if signature else []):
+                if signature_of(leader_path) == signature:
+                    logging.debug(f"{file_path} has the same audio as {leader_path}")
+                    future = Future()
+                    when_finished(leader_future, lambda status: start_duplicate(future, file_path, leader_path))
+                    return future
+            return self.convert_job(file_path, output_format, delete_source, delete_cue, directory)
+
+        def collect_finished(timeout, force_progress=False):
+            nonlocal finished_files, last_progress
+            try:
+                item = done_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            changed = force_progress
+            while item is not None:
+                changed = True
+                file_path, future, job_seconds = item
+                try:
+                    status = future.result()
+                except CancelledError:
+                    status = "stopped"
+                except Exception as e:
+                    status = "failed"
+                    self.log(f"Unexpected error converting {file_path.name}: {e}")
+                    logging.error(f"Unexpected error in worker for {file_path}: {e}", exc_info=True)
+                results[status] += 1
+                finished_files += 1
+                self.finish_job_audio(file_path, job_seconds, status == "converted")
+                logging.debug(f"Finished file {finished_files} of {total_files} ({status}): {file_path}")
+                self.emit("file", path=str(file_path), status=status)
+                try:
+                    item = done_queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            now = time.monotonic()
+            if changed or now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                self.emit_progress(finished_files, total_files, scanning)
+
+        if files is None:
+            files = discover_audio_files(directory, recursive)
+        if options.schedule == "discovery":
+            jobs = files  # jobs start while the walk is still running
+        else:
+            jobs = self.scheduled_files(files)
+
+        watchdog_done = threading.Event()
+        if options.job_timeout:
+            threading.Thread(target=self.watchdog, args=(watchdog_done,), name="job-watchdog", daemon=True).start()
+
+        with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="ffmpeg-worker") as executor:
+            for file_path in jobs:
+                while self.running and not slots.acquire(timeout=0.1):
+                    collect_finished(0)
+                if not self.running:
+                    break
+                total_files += 1
+                job_seconds = self.estimate_job_seconds(file_path)
+                with self.progress_lock:
+                    self.audio_total += job_seconds
+                self.journal.record(file_path, "pending")
+                group = None
+                if options.deduplicate and job_seconds:
+                    group = same_duration.setdefault((file_path.suffix.lower(), self.probe_file(file_path)["duration"]), [])
+                if group or (group is not None and delete_source):
+                    future = executor.submit(dedupe_job, file_path, list(group))
+                else:
+                    future = executor.submit(self.convert_job, file_path, output_format, delete_source, delete_cue, directory)
+                if group is not None:
+                    group.append((file_path, future))
+                future.add_done_callback(lambda f, p=file_path, d=job_seconds: job_done(f, p, d))
+                collect_finished(0, force_progress=True)
+            scanning = False
+            logging.debug(f"Discovery finished: {total_files} audio file(s) found")
+
+            if total_files == 0 and self.running:
+                watchdog_done.set()
+                self.log("No audio files found.")
+                self.journal.close(finished=True)
+                self.timings.close()
+                self.cleanup_artwork_cache()
+                self.close_writer()
+                self.close_verifier()
+                self.finish(results)
+                return results
+
+            collect_finished(0, force_progress=True)
+            cancelled = False
+            while finished_files < total_files:
+                if not self.running and not cancelled:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    if self.writer:
+                        self.writer.cancel()  # cancelled copies still reach job_done as "stopped"
+                    cancelled = True
+                collect_finished(0.1)
+        watchdog_done.set()
+
+        self.probe_cache.save()
+        if self.audio_done >= MIN_SPEED_SAMPLE_SECONDS and self.encode_time_done > 0:
+            save_encode_speed(output_format, self.audio_done / self.encode_time_done)
+        self.journal.close(finished=self.running)
+        self.cleanup_artwork_cache()
+        self.close_writer()
+        self.close_verifier()
+        self.report_timings()
+        self.log(
+            f"Converted: {results['converted']}, copied from duplicates: {results['copied']},"
+            f" skipped: {results['skipped']}, failed: {results['failed']}"
+        )
+        if self.running:
+            self.log("Conversion completed.")
+        else:
+            self.log("Conversion stopped by user.")
+        self.finish(results)
+        return results
+
+    def watch(self, poll_interval=WATCH_POLL_SECONDS, settle_seconds=WATCH_SETTLE_SECONDS):
+        """Convert the tree once, then keep converting files that appear or change until stop().
+
+        Each batch of new files that have stopped growing goes through run() like a normal
+        conversion; outputs the engine writes itself are not picked up as new files.
+        """
+        directory = Path(self.options.directory)
+        if not directory.exists():
+            self.log("Invalid directory.")
+            return
+        with self.state_lock:
+            if self.stop_requested:
+                return
+            self.watching = True
+        try:
+            watcher = FolderWatcher(directory, self.options.recursive, settle_seconds)
+            settled = watcher.start()
+            if watcher.pending:
+                self.log(f"Waiting for {len(watcher.pending)} recently changed file(s) to stop growing")
+            if settled:
+                self.run(settled)
+            while not self.stop_requested:
+                with self.dedupe_lock:
+                    watcher.mark_seen(list(self.job_outputs.values()))
+                self.log(f"Watching {directory} for new files...")
+                ready = []
+                while not ready and not self.stop_event.wait(poll_interval):
+                    ready = watcher.poll()
+                if not ready:
+                    break
+                self.log(f"Found {len(ready)} new or changed file(s)")
+                self.run(ready)
+        finally:
+            with self.state_lock:
+                self.watching = False
+            self.log("Stopped watching.")
+
+    def plan(self):
+        """Dry run: scan and probe like run(), but encode, write and delete nothing.
+
+        Counts what FLAC-16 and MP3 output would convert and skip, and what the chosen options
+        would delete, with estimated output bytes and, once this machine has timed a real
+        conversion, the expected wall-clock time. Emits a "plan" event and returns the same dict.
+        """
+        if not self.begin_run():
+            return None
+        options = self.options
+        directory = Path(options.directory)
+        if not directory.exists():
+            self.log("Invalid directory.")
+            self.running = False
+            return None
+        self.log("Planning conversion (no files will be changed)...")
+        self.started_at = time.monotonic()
+        self.audio_total = 0.0
+        self.audio_done = 0.0
+        self.audio_active = {}
+
+        files = []
+        last_progress = 0.0
+        for file_path in discover_audio_files(directory, options.recursive):
+            if not self.running:
+                break
+            files.append(file_path)
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                self.emit_progress(0, len(files), True)
+
+        num_workers = max(1, int(options.workers))
+        speeds = load_encode_speeds()
+        formats = {
+            output_format: {"convert": 0, "skip_16bit": 0, "up_to_date": 0, "audio_seconds": 0.0, "output_bytes": 0}
+            for output_format in ("flac", "mp3")
+        }
+        formats["mp3"]["bitrate"] = options.bitrate
+        source_bytes = 0
+        sources_deleted = 0
+        cue_files = set()
+        finished = 0
+        # Probing a cold cache is I/O bound, so batches are spread over the worker threads; stats release the GIL
+        batches = [files[i:i + PLAN_BATCH_SIZE] for i in range(0, len(files), PLAN_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="plan-worker") as executor:
+            for batch_plans in executor.map(lambda batch: [self.plan_file(f, directory) for f in batch], batches):
+                if not self.running:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                for file_plan in batch_plans:
+                    finished += 1
+                    source_bytes += file_plan["size"]
+                    for output_format, (state, output_bytes) in file_plan["formats"].items():
+                        stats = formats[output_format]
+                        stats[state] += 1
+                        if state == "convert":
+                            stats["audio_seconds"] += file_plan["duration"]
+                            stats["output_bytes"] += output_bytes
+                    if options.delete_source and file_plan["deletes_source"]:
+                        sources_deleted += 1
+                    if options.delete_cue and file_plan["cue_file"]:
+                        cue_files.add(file_plan["cue_file"])
+                now = time.monotonic()
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = now
+                    self.emit_progress(finished, len(files), False)
+
+        effective_workers = min(num_workers, default_worker_count())
+        for output_format, stats in formats.items():
+            stats["audio_seconds"] = round(stats["audio_seconds"], 1)
+            realtime = speeds.get(output_format, {}).get("realtime")
+            stats["realtime"] = realtime
+            stats["estimated_seconds"] = round(stats["audio_seconds"] / (realtime * effective_workers)) if realtime else None
+
+        self.probe_cache.save()
+        result = {
+            "files": finished,
+            "complete": self.running,
+            "output_format": options.output_format,
+            "workers": num_workers,
+            "source_bytes": source_bytes,
+            "formats": formats,
+            "delete_sources": sources_deleted,
+            "delete_cue_files": len(cue_files),
+            "plan_seconds": round(time.monotonic() - self.started_at, 3),
+        }
+        for line in self.format_plan(result):
+            self.log(line)
+        self.emit("plan", **result)
+        self.running = False
+        return result
+
+    def plan_file(self, file_path, target_dir):
+        """What run() would do with one file, for each output format, without doing it."""
+        options = self.options
+        probe = self.probe_file(file_path)
+        try:
+            source_size = file_path.stat().st_size
+        except OSError:
+            source_size = 0
+        file_plan = {"size": source_size, "duration": probe["duration"] or 0.0, "formats": {},
+                     "deletes_source": False, "cue_file": None}
+        for output_format in ("flac", "mp3"):
+            output_bytes = 0
+            if output_format == "flac" and probe["bit_depth"] == 16:
+                state = "skip_16bit"
+            else:
+                output_file = self.output_file_for(file_path, probe, output_format, options.delete_source, target_dir)
+                keeps_source = output_file == file_path and (output_format == "mp3" or not options.delete_source)
+                if keeps_source:
+                    # An earlier output found again, or an MP3 already in the target format; only
+                    # the FLAC 24 -> 16 bit case replaces its source in place
+                    state = "up_to_date"
+                elif output_file != file_path and self.is_up_to_date(output_file, file_path):
+                    state = "up_to_date"
+                else:
+                    state = "convert"
+                    output_bytes = estimate_output_bytes(probe, source_size, output_format, options.bitrate)
+                if output_format == options.output_format and not keeps_source:
+                    # Converted, already-converted and replaced-in-place sources all go with delete_source
+                    file_plan["deletes_source"] = True
+            file_plan["formats"][output_format] = (state, output_bytes)
+        if options.delete_cue:
+            cue_file = file_path.with_suffix(".cue")
+            if cue_file.exists():
+                file_plan["cue_file"] = str(cue_file)
+        return file_plan
+
+    @staticmethod
+    def format_plan(plan):
+        lines = [f"Plan for {plan['files']} audio files ({format_bytes(plan['source_bytes'])}), {plan['workers']} worker(s):"]
+        if not plan["complete"]:
+            lines[0] += " (stopped early, partial)"
+        for output_format, label in (("flac", "FLAC 16-bit"), ("mp3", f"MP3 {plan['formats']['mp3']['bitrate']}k")):
+            stats = plan["formats"][output_format]
+            chosen = "  <- selected" if output_format == plan["output_format"] else ""
+            if stats["estimated_seconds"] is not None:
+                eta = f"~{stats['estimated_seconds'] / 60:.0f} min at {stats['realtime']:.0f}x realtime per worker"
+            else:
+                eta = "time unknown until a conversion has been timed on this machine"
+            lines.append(
+                f"  {label}: convert {stats['convert']}, skip {stats['skip_16bit']} (16-bit),"
+                f" {stats['up_to_date']} already converted, ~{format_bytes(stats['output_bytes'])} out, {eta}{chosen}"
+            )
+        lines.append(f"  Would delete {plan['delete_sources']} source files and {plan['delete_cue_files']} .cue files")
+        lines.append(f"  Planned in {plan['plan_seconds']:.1f}s")
+        return lines
+
+    def report_timings(self):
+        summary = self.timings.summary()
+        self.timings.close()
+        for line in RunTimings.format_summary(summary):
+            self.log(line)
+        summary["dedupe_saved_seconds"] = round(self.dedupe_saved, 3)
+        if self.dedupe_saved:
+            self.log(f"Duplicate sources reused existing encodes, saving {self.dedupe_saved:.1f}s of encoding")
+        if self.timings.timings_file:
+            self.log(f"Timing records: {self.timings.timings_file}")
+        self.emit("report", **summary)
+
+    def scheduled_files(self, files):
+        """Discover and probe every file up front, then order the jobs by estimated encode cost.
+
+        "longest" starts the most expensive files first, so a long track never runs alone at the
+        end of a parallel run. "album" keeps each album's tracks together, largest album first and
+        longest track first within it, so finished output folders appear early.
+        """
+        jobs = []
+        album_costs = {}
+        last_progress = 0.0
+        for file_path in files:
+            if not self.running:
+                return []
+            probe = self.probe_file(file_path)
+            cost = self.estimate_job_seconds(file_path) * (probe["sample_rate"] or 44100) * (probe["channels"] or 2)
+            album = (probe["artist"], probe["album"])
+            album_costs[album] = album_costs.get(album, 0.0) + cost
+            jobs.append((file_path, album, cost))
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                self.emit_progress(0, len(jobs), True)
+
+        if self.options.schedule == "album":
+            jobs.sort(key=lambda job: (-album_costs[job[1]], job[1], -job[2]))
+        else:
+            jobs.sort(key=lambda job: -job[2])
+        logging.debug(f"Scheduled {len(jobs)} file(s) in {self.options.schedule} order")
+        return [file_path for file_path, _, _ in jobs]
+
+    def estimate_job_seconds(self, file_path):
+        """Seconds of audio this file adds to the encode workload; 0 if it will be skipped."""
+        probe = self.probe_file(file_path)
+        if self.options.output_format == "flac" and probe["bit_depth"] == 16:
+            return 0.0
+        return probe["duration"] or 0.0
+
+    def job_signature(self, file_path):
+        """audio_signature, kept in the probe cache entry so unchanged files are hashed once."""
+        probe = self.probe_file(file_path)
+        if "signature" in probe:
+            return probe["signature"]
+        try:
+            with self.timings.stage(file_path, "signature") as record:
+                signature = audio_signature(file_path)
+                if signature.startswith("sha1:"):
+                    record["bytes_read"] = file_path.stat().st_size
+        except (OSError, struct.error) as e:
+            logging.warning(f"Cannot compute audio signature for {file_path}: {e}")
+            return None
+        if self.probe_cache.get(file_path) is not None:
+            self.probe_cache.put(file_path, {**probe, "signature": signature})
+        return signature
+
+    def finish_job_audio(self, file_path, job_seconds, converted):
+        with self.progress_lock:
+            self.audio_active.pop(str(file_path), None)
+            if converted:
+                self.audio_done += job_seconds
+                self.encode_time_done += self.encode_seconds.get(str(file_path), 0.0)
+            else:
+                # Failed, stopped or resumed jobs are no longer part of the workload
+                self.audio_total -= job_seconds
+
+    def update_job_progress(self, file_path, out_seconds, duration, speed):
+        if duration:
+            out_seconds = min(out_seconds, duration)
+        with self.progress_lock:
+            self.audio_active[str(file_path)] = out_seconds
+        percent = round(out_seconds / duration * 100, 1) if duration else None
+        self.emit("file_progress", path=str(file_path), percent=percent, speed=speed)
+
+    def emit_progress(self, finished_files, total_files, scanning):
+        with self.progress_lock:
+            audio_processed = self.audio_done + sum(self.audio_active.values())
+            audio_total = max(self.audio_total, audio_processed)
+        elapsed = time.monotonic() - self.started_at
+        # Seconds of audio per wall-clock second, i.e. audio-hours encoded per hour
+        throughput = audio_processed / elapsed if elapsed > 0 else 0.0
+        eta = (audio_total - audio_processed) / throughput if throughput > 0 else None
+        self.emit(
+            "progress",
+            finished=finished_files,
+            total=total_files,
+            scanning=scanning,
+            audio_processed=round(audio_processed, 1),
+            audio_total=round(audio_total, 1),
+            throughput=round(throughput, 2),
+            eta=round(eta) if eta is not None else None,
+        )
+
+    def finish(self, results):
+        self.running = False
+        self.emit("done", stop_requested=self.stop_requested, **results)
+
+    def convert_job(self, file_path, output_format, delete_source, delete_cue, target_dir, duplicate_of=None):
+        if not self.running:
+            return "stopped"
+
+        status = self.convert_audio(file_path, output_format, delete_source, target_dir, duplicate_of)
+        if isinstance(status, Future):
+            return status  # the writer calls finish_job once the output is on the target
+        self.finish_job(file_path, status)
+        return status
+
+    def finish_job(self, file_path, status):
+        if self.options.delete_cue and status != "stopped":
+            cue_file_path = file_path.with_suffix('.cue')
+            if cue_file_path.exists():
+                try:
+                    os.remove(cue_file_path)
+                    self.log(f"Deleted CUE file: {cue_file_path.name}")
+                    logging.info(f"Deleted CUE file: {cue_file_path}")
+                except OSError as e:
+                    self.log(f"Error deleting CUE file {cue_file_path.name}: {e}")
+                    logging.error(f"Error deleting CUE file {cue_file_path}: {e}")
+            else:
+                logging.debug(f"No .cue file found for {file_path.name} in the same directory.")
+
+    def output_file_for(self, file_path, probe, output_format, delete_source, target_dir):
+        artist, album = probe["artist"], probe["album"]
+        if delete_source:
+            output_dir = file_path.parent
+        else:
+            base_output_path = Path(self.options.output_subdir) if self.options.output_subdir else target_dir
+            sanitized_artist = "".join(c for c in artist if c.isalnum() or c in (' ', '.', '_', '-')).strip()
+            sanitized_album = "".join(c for c in album if c.isalnum() or c in (' ', '.', '_', '-')).strip()
+            
+            suffix = "MP3" if output_format == "mp3" else "16bit"
+            output_dir = base_output_path / f"{sanitized_artist} - {sanitized_album} {suffix}"
+
+        output_file_name = file_path.stem + f".{output_format}"
+        return output_dir / output_file_name
+
+    def duplicate_job(self, file_path, leader_path, output_format, delete_source, delete_cue, target_dir):
+        """Job for a source identical to leader_path, started once the leader's job has finished."""
+        with self.dedupe_lock:
+            leader_output = self.job_outputs.get(str(leader_path))
+        if leader_output is None or not leader_output.exists():
+            # The leader failed or was stopped, so this copy has to be encoded after all
+            return self.convert_job(file_path, output_format, delete_source, delete_cue, target_dir)
+        return self.convert_job(file_path, output_format, delete_source, delete_cue, target_dir,
+                                duplicate_of=(leader_path, leader_output))
+
+    def convert_audio(self, file_path, output_format, delete_source, target_dir, duplicate_of=None):
+        if not self.running:
+            return "stopped"
+
+        probe = self.probe_file(file_path)
+        duration = probe["duration"]
+        if output_format == "flac":
+            if probe["bit_depth"] == 16:
+                self.log(f"Skipping {file_path.name} (already 16-bit FLAC)")
+                return "skipped"
+
+        output_file = self.output_file_for(file_path, probe, output_format, delete_source, target_dir)
+        if not delete_source:
+            output_file.parent.mkdir(parents=True, exist_ok=True)
+        partial_file = partial_output_path(output_file, file_path)
+
+        if output_file == file_path and (output_format == "mp3" or not delete_source):
+            # e.g. an earlier MP3 output found again by a recursive scan. Never overwrite a kept source,
+            # and never re-encode an MP3 onto itself: each pass would add another lossy generation.
+            # Only the FLAC 24 -> 16 bit case replaces its source in place.
+            self.log(f"Skipping {file_path.name} (output would overwrite the source)")
+            return "skipped"
+
+        owner = self.claim_output(output_file, file_path, duplicate_of)
+        if owner is not None:
+            self.log(f"Not converting {file_path}: its output {output_file} is already taken by {owner}")
+            logging.error(f"Output collision: {file_path} and {owner} both map to {output_file}")
+            self.journal.record(file_path, "failed", output_file)
+            return "failed"
+
+        if output_file != file_path and self.is_up_to_date(output_file, file_path):
+            self.log(f"Skipping {file_path.name} (already converted to {output_file.name})")
+            if delete_source and self.verifier:
+                # An existing output is checked too before it stands in for the deleted source
+                return self.verifier.submit(self.verify_job, file_path, output_file, delete_source, "skipped")
+            self.mark_done(file_path, output_file)
+            if delete_source:
+                self.delete_source_file(file_path)
+            return "skipped"
+
+        if duplicate_of is not None:
+            return self.copy_duplicate_output(file_path, output_file, duplicate_of, delete_source)
+
+        # With staging, ffmpeg writes to local disk and the writer copies the result to the target
+        encode_file = self.writer.staged_path(output_file) if self.writer else partial_file
+
+        self.journal.record(file_path, "encoding", output_file)
+        try:
+            if output_format == "flac":
+                cmd = [
+                    "ffmpeg", "-y", "-i", str(file_path),
+                    "-map", "0:a",
+                    "-map_metadata", "0",
+                    "-c:a", "flac",
+                    "-sample_fmt", "s16", "-ar", "44100",
+                    str(encode_file)
+                ]
+                self.log(f"Converting {file_path.name} to 16-bit FLAC...")
+                logging.debug(f"FFmpeg command: {' '.join(cmd)}")
+                result = self.timed_encode(cmd, file_path, duration, encode_file)
+                logging.debug(f"FFmpeg return code: {result.returncode}")
+                if result.returncode != 0:
+                    if self.stop_requested:
+                        return self.abandon_job(file_path, encode_file)
+                    logging.error(f"FFmpeg error: {result.stderr}")
+                    self.log(f"Failed to convert {file_path.name}:")
+                    self.log(result.stderr)
+                    self.discard_partial_output(encode_file)
+                    self.journal.record(file_path, "failed", output_file)
+                    return "failed"
+
+            elif output_format == "mp3":
+                selected_bitrate = f"{self.options.bitrate}k"
+                with self.timings.stage(file_path, "artwork"):
+                    artwork = self.get_artwork(file_path)
+                has_artwork = artwork is not None
+
+                cmd = ["ffmpeg", "-y", "-i", str(file_path)]
+                if has_artwork:
+                    cmd.extend(["-i", str(artwork)])
+                cmd.extend(["-map", "0:a"])
+                if has_artwork:
+                    # The cached JPEG is already baseline yuv420p for Rockbox; copy it, don't re-encode it
+                    cmd.extend(["-map", "1:v", "-c:v", "copy", "-disposition:v", "attached_pic"])
+                cmd.extend([
+                    "-b:a", selected_bitrate, "-ar", "44100", "-ac", "2",
+                    "-map_metadata", "0", "-id3v2_version", "3", "-write_id3v1", "1",
+                    str(encode_file)
+                ])
+
+                self.log(f"Converting {file_path.name} to MP3 ({selected_bitrate})...")
+                logging.debug(f"MP3 conversion command: {' '.join(cmd)}")
+                result = self.timed_encode(cmd, file_path, duration, encode_file)
+                logging.debug(f"MP3 conversion return code: {result.returncode}")
+                logging.debug(f"MP3 conversion stderr: {result.stderr}")
+
+                if result.returncode != 0:
+                    if self.stop_requested:
+                        return self.abandon_job(file_path, encode_file)
+                    logging.error(f"FFmpeg error: {result.stderr}")
+                    self.log(f"Failed to convert {file_path.name} to MP3:")
+                    self.log(result.stderr)
+                    self.discard_partial_output(encode_file)
+                    self.journal.record(file_path, "failed", output_file)
+                    return "failed"
+
+            if self.writer:
+                return self.submit_stage(self.writer, self.write_staged_output, encode_file, file_path, output_file, delete_source)
+
+            if self.verifier:
+                # Replacing a source in place has to wait for verification; anything else is renamed now
+                if output_file != file_path:
+                    with self.timings.stage(file_path, "finalize"):
+                        os.replace(partial_file, output_file)
+                return self.verifier.submit(self.verify_job, file_path, output_file, delete_source)
+
+            with self.timings.stage(file_path, "finalize"):
+                os.replace(partial_file, output_file)
+                self.mark_done(file_path, output_file)
+            self.remove_converted_source(file_path, output_file, delete_source)
+            return "converted"
+
+        except Exception as e:
+            self.log(f"Unexpected error converting {file_path.name}: {e}")
+            logging.error(f"Unexpected error converting {file_path.name}: {e}", exc_info=True)
+            self.discard_partial_output(encode_file)
+            self.journal.record(file_path, "failed", output_file)
+            return "failed"
+
+    def write_staged_output(self, staged_file, file_path, output_file, delete_source):
+        """Writer stage: copy a staged encode to the target, then finish the job."""
+        if self.stop_requested:
+            self.discard_partial_output(staged_file)
+            return "stopped"
+        try:
+            with self.timings.stage(file_path, "write") as record:
+                # Deleting the source relies on the copy, so that case is always fsynced
+                record["bytes_written"] = self.writer.copy_into_place(
+                    staged_file, output_file, partial_output_path(output_file, file_path), durable=delete_source,
+                    replace=not (self.verifier and output_file == file_path),
+                )
+            if self.verifier:
+                return self.verifier.submit(self.verify_job, file_path, output_file, delete_source)
+            self.mark_done(file_path, output_file)
+            self.remove_converted_source(file_path, output_file, delete_source)
+            status = "converted"
+        except Exception as e:
+            self.log(f"Error writing {output_file.name} to the target: {e}")
+            logging.error(f"Error writing {staged_file} to {output_file}: {e}", exc_info=True)
+            self.discard_partial_output(partial_output_path(output_file, file_path))
+            self.discard_partial_output(staged_file)
+            self.journal.record(file_path, "failed", output_file)
+            status = "failed"
+        self.finish_job(file_path, status)
+        return status
+
+    def claim_output(self, output_file, file_path, duplicate_of=None):
+        """Reserve output_file for file_path; returns the other source that already holds it, or None.
+
+        A duplicate may share its leader's output (copy_duplicate_output skips it then).
+        """
+        with self.claims_lock:
+            owner = self.output_claims.setdefault(str(output_file), file_path)
+        if owner == file_path or (duplicate_of is not None and owner == duplicate_of[0]):
+            return None
+        return owner
+
+    def submit_stage(self, stage, fn, *args):
+        """Hand a finished encode on to the next stage; a stop may already have shut that stage down."""
+        try:
+            return stage.submit(fn, *args)
+        except RuntimeError:
+            return "stopped"
+
+    def abandon_job(self, file_path, encode_file):
+        """A job killed by stop(): drop its partial output, keep the journal entry for the next run."""
+        self.discard_partial_output(encode_file)
+        logging.info(f"Stopped while converting {file_path}")
+        return "stopped"
+
+    def copy_duplicate_output(self, file_path, output_file, duplicate_of, delete_source):
+        """Hard-link (or, across filesystems, copy) the leader's output instead of encoding again."""
+        leader_path, leader_output = duplicate_of
+        if output_file == leader_output:
+            self.log(f"Skipping {file_path.name} (duplicate of {leader_path.name}, same output)")
+            self.mark_done(file_path, output_file)
+            return "skipped"
+
+        partial_file = partial_output_path(output_file, file_path)
+        self.journal.record(file_path, "encoding", output_file)
+        try:
+            with self.timings.stage(file_path, "duplicate") as record:
+                try:
+                    os.link(leader_output, partial_file)
+                except OSError:
+                    shutil.copyfile(leader_output, partial_file)
+                    record["bytes_written"] = partial_file.stat().st_size
+            if not (self.verifier and output_file == file_path):
+                # An in-place replacement stays at its .part name until the verifier passes it
+                os.replace(partial_file, output_file)
+            if not self.verifier:
+                self.mark_done(file_path, output_file)
+        except OSError as e:
+            self.log(f"Error copying duplicate output for {file_path.name}: {e}")
+            logging.error(f"Error copying {leader_output} to {output_file}: {e}", exc_info=True)
+            self.discard_partial_output(partial_file)
+            self.journal.record(file_path, "failed", output_file)
+            return "failed"
+
+        with self.dedupe_lock:
+            saved = self.encode_seconds.get(str(leader_path), 0.0)
+            self.dedupe_saved += saved
+        self.log(f"Copied {output_file.name} from the output of identical {leader_path.name}")
+        logging.debug(f"Duplicate of {leader_path} saved {saved:.1f}s of encoding: {file_path}")
+        if self.verifier:
+            return self.verifier.submit(self.verify_job, file_path, output_file, delete_source, "copied")
+        self.remove_converted_source(file_path, output_file, delete_source)
+        return "copied"
+
+    def mark_done(self, file_path, output_file):
+        self.journal.record(file_path, "done", output_file)
+        with self.dedupe_lock:
+            self.job_outputs[str(file_path)] = output_file
+
+    def verify_job(self, file_path, output_file, delete_source, status="converted"):
+        """Verify stage: check an output on the target before its source may go.
+
+        An output that replaces its source in place is checked at its .part name and only renamed
+        over the source once it passes. A failed output is deleted and the source is kept.
+        """
+        verify_file = partial_output_path(output_file, file_path) if output_file == file_path else output_file
+        if self.running:
+            with self.timings.stage(file_path, "verify") as record:
+                error = self.verify_output(verify_file, file_path)
+                try:
+                    record["bytes_read"] = verify_file.stat().st_size
+                except OSError:
+                    pass
+        if not self.running:
+            # Stopped (possibly mid-decode): nothing is deleted, an unrenamed in-place output is dropped
+            if verify_file != output_file:
+                self.discard_partial_output(verify_file)
+            return "stopped"
+
+        if error:
+            self.log(f"Verification failed for {output_file.name}, keeping the source: {error}")
+            logging.error(f"Verification failed for {verify_file} (source {file_path}): {error}")
+            self.discard_partial_output(verify_file)
+            self.journal.record(file_path, "failed", output_file)
+            status = "failed"
+        else:
+            logging.debug(f"Verified {verify_file}")
+            if verify_file != output_file:
+                verified = self.verify_cache.get(verify_file)
+                os.replace(verify_file, output_file)
+                self.verify_cache.put(output_file, verified)
+                self.verify_cache.invalidate(verify_file)
+            self.mark_done(file_path, output_file)
+            self.remove_converted_source(file_path, output_file, delete_source)
+        self.finish_job(file_path, status)
+        return status
+
+    def verify_output(self, output_file, file_path):
+        """Decode-test output_file and check its layout and duration; returns an error message or None.
+
+        Outputs that passed before are remembered in the verify cache by size and mtime, so only
+        the duration comparison with the (probed) source is repeated for them.
+        """
+        verified = self.verify_cache.get(output_file)
+        if verified is None:
+            if self.options.output_format == "flac":
+                try:
+                    header = read_flac_header(output_file)
+                except (OSError, struct.error) as e:
+                    return f"unreadable FLAC header: {e}"
+                if header is None:
+                    return "not a FLAC stream"
+                layout = (header["bits_per_sample"], header["sample_rate"])
+                if layout != (16, 44100):
+                    return f"expected 16-bit/44100 Hz, found {layout[0]}-bit/{layout[1]} Hz"
+            else:
+                try:
+                    audio = File(output_file)
+                except Exception as e:
+                    return f"unreadable MP3: {e}"
+                info = getattr(audio, "info", None)
+                if info is None:
+                    return "not an MP3 stream"
+                if (info.sample_rate, info.channels) != (44100, 2):
+                    return f"expected 44100 Hz stereo, found {info.sample_rate} Hz, {info.channels} channel(s)"
+
+            cmd = ["ffmpeg", "-v", "error", "-i", str(output_file), "-map", "0:a", "-f", "null", "-"]
+            result = self.run_ffmpeg(cmd, file_path, None, report_progress=False)
+            if result.returncode != 0 or result.stderr.strip():
+                return f"decode test failed: {result.stderr.strip()[:500]}"
+            decoded = None
+            for line in result.stdout.splitlines():
+                name, _, value = line.partition("=")
+                if name == "out_time_us" and value.isdigit():
+                    decoded = int(value) / 1000000
+            if decoded is None:
+                return "decode test reported no duration"
+            verified = {"duration": decoded}
+            self.verify_cache.put(output_file, verified)
+
+        expected = self.probe_file(file_path)["duration"]
+        if expected and abs(verified["duration"] - expected) > VERIFY_DURATION_TOLERANCE:
+            return f"decoded {verified['duration']:.2f}s, source is {expected:.2f}s"
+        return None
+
+    def remove_converted_source(self, file_path, output_file, delete_source):
+        if not delete_source:
+            return
+        if output_file == file_path:
+            # Same name and format: the rename into place already replaced the source
+            self.log(f"Replaced source file: {file_path.name}")
+            logging.info(f"Replaced source file in place: {file_path}")
+        else:
+            self.delete_source_file(file_path)
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close_verifier(self):
+        if self.verifier is not None:
+            self.verifier.shutdown(wait=True)
+            self.verifier = None
+            self.verify_cache.save()
+
+    def timed_encode(self, cmd, file_path, duration, partial_file):
+        with self.timings.stage(file_path, "encode") as record:
+            result = self.run_ffmpeg(cmd, file_path, duration)
+            try:
+                record["bytes_read"] = file_path.stat().st_size
+                if result.returncode == 0:
+                    record["bytes_written"] = partial_file.stat().st_size
+            except OSError:
+                pass
+        with self.dedupe_lock:
+            self.encode_seconds[str(file_path)] = record["seconds"]
+        return result
+
+    def run_ffmpeg(self, cmd, file_path, duration, report_progress=True):
+        """Run ffmpeg, turning its -progress output into file_progress events.
+
+        Returns a CompletedProcess with the return code and stderr, like subprocess.run did;
+        stdout holds the last complete -progress block.
+        """
+        cmd = self.job_prefix + [cmd[0], "-nostdin", "-progress", "pipe:1", "-nostats"] + cmd[1:]
+        # stderr goes to a temp file so a chatty ffmpeg can never block on a full pipe
+        with tempfile.TemporaryFile(mode="w+", encoding="utf-8", errors="replace") as stderr_file:
+            # A new session makes ffmpeg a process group leader that stop() can kill as a whole
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=True, start_new_session=True)
+            job = {"process": process, "file": file_path, "last_progress": time.monotonic(), "timed_out": False}
+            with self.process_lock:
+                self.processes[process.pid] = job
+            if self.stop_requested:
+                self.kill_process_group(process)  # stop() ran between the job starting and its registration
+            out_seconds = 0.0
+            speed = None
+            block = []
+            last_block = []
+            for line in process.stdout:
+                block.append(line)
+                name, _, value = line.strip().partition("=")
+                if name in ("out_time_us", "out_time_ms") and value.isdigit():
+                    seconds = int(value) / 1000000  # both keys are in microseconds
+                    if seconds > out_seconds:
+                        # ffmpeg keeps printing blocks while stuck on a corrupt input; only moving output counts
+                        out_seconds = seconds
+                        job["last_progress"] = time.monotonic()
+                elif name == "speed" and value.endswith("x"):
+                    try:
+                        speed = float(value[:-1])
+                    except ValueError:
+                        pass
+                elif name == "progress":
+                    last_block, block = block, []
+                    if report_progress:
+                        self.update_job_progress(file_path, out_seconds, duration, speed)
+            returncode = process.wait()
+            with self.process_lock:
+                del self.processes[process.pid]
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+        if job["timed_out"]:
+            stderr = f"Killed after {self.options.job_timeout:.0f}s without progress\n{stderr}"
+        return subprocess.CompletedProcess(cmd, returncode, "".join(last_block), stderr)
+
+    def get_artwork(self, file_path):
+        try:
+            picture_data = read_embedded_picture(file_path)
+        except Exception as e:
+            logging.warning(f"Could not read embedded picture from {file_path.name}, trying ffmpeg: {e}")
+            return self.artwork_cache.extract_with_ffmpeg(file_path)
+        if not picture_data:
+            self.log(f"No artwork found for {file_path.name}.")
+            logging.warning(f"No embedded artwork in {file_path}")
+            return None
+        artwork = self.artwork_cache.get(picture_data)
+        logging.debug(f"Artwork for {file_path.name}: {artwork}")
+        return artwork
+
+    def cleanup_artwork_cache(self):
+        if self.artwork_cache is not None:
+            self.artwork_cache.cleanup()
+            self.artwork_cache = None
+
+    def is_up_to_date(self, output_file, source_file):
+        # Outputs only appear under their final name once complete, so existing and newer means done
+        try:
+            return output_file.stat().st_mtime >= source_file.stat().st_mtime
+        except OSError:
+            return False
+
+    def discard_partial_output(self, partial_file):
+        try:
+            os.remove(partial_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Error removing partial output {partial_file}: {e}")
+
+    def delete_source_file(self, file_path):
+        try:
+            with self.timings.stage(file_path, "delete_source"):
+                os.remove(file_path)
+            self.log(f"Deleted source file: {file_path.name}")
+            logging.info(f"Deleted source file: {file_path}")
+        except OSError as e:
+            self.log(f"Error deleting source file {file_path.name}: {e}")
+            logging.error(f"Error deleting source file {file_path}: {e}")
+
+    def probe_file(self, file_path):
+        with self.timings.stage_once(file_path, "probe_cache"):
+            cached = self.probe_cache.get(file_path)
+        if cached is not None:
+            return cached
+        try:
+            signature = StatCache.file_signature(file_path)
+        except OSError:
+            signature = None
+        with self.failed_probes_lock:
+            failed = self.failed_probes.get(str(file_path))
+        if failed is not None and failed[0] == signature:
+            return failed[1]
+
+        probe = None
+        probe_ok = True
+        if file_path.suffix.lower() == ".flac":
+            try:
+                with self.timings.stage(file_path, "probe_header"):
+                    header = read_flac_header(file_path)
+            except (OSError, struct.error) as e:
+                logging.warning(f"FLAC header parse failed for {file_path}: {e}")
+                header = None
+            if header is not None:
+                logging.debug(f"FLAC header for {file_path.name}: {header['bits_per_sample']}-bit/{header['sample_rate']} Hz")
+                probe = {
+                    "bit_depth": 24 if header["bits_per_sample"] > 16 else 16,
+                    "sample_rate": header["sample_rate"],
+                    "channels": header["channels"],
+                    "duration": header["duration"],
+                    "artist": clean_tag(header["artist"], "Unknown Artist"),
+                    "album": clean_tag(header["album"], "Unknown Album"),
+                }
+
+        if probe is None:
+            try:
+                with self.timings.stage(file_path, "probe_mutagen"):
+                    audio = File(file_path)
+                tags_ok = True
+            except Exception as e:
+                self.log(f"Error reading metadata for {file_path.name}: {e}")
+                logging.error(f"Error reading metadata for {file_path.name}: {e}", exc_info=True)
+                audio = None
+                tags_ok = False
+
+            if file_path.suffix.lower() == ".mp3":
+                # MP3 is lossy and has no bit depth; ffprobe reported none and it was always treated as 16-bit
+                bit_depth, bit_depth_ok = 16, tags_ok
+            else:
+                with self.timings.stage(file_path, "probe_ffprobe"):
+                    bit_depth, bit_depth_ok = self.ffprobe_bit_depth(file_path)
+
+            artist, album = self.read_tags(audio)
+            info = getattr(audio, "info", None)
+            probe = {
+                "bit_depth": bit_depth,
+                "sample_rate": getattr(info, "sample_rate", None),
+                "channels": getattr(info, "channels", None),
+                "duration": getattr(info, "length", None),
+                "artist": artist,
+                "album": album,
+            }
+            probe_ok = bit_depth_ok and tags_ok
+
+        # Failed probes fall back to defaults; only cache real answers so a later run can retry
+        if probe_ok:
+            self.probe_cache.put(file_path, probe)
+        else:
+            with self.failed_probes_lock:
+                self.failed_probes[str(file_path)] = (signature, probe)
+        return probe
+
+    def get_metadata(self, file_path):
+        probe = self.probe_file(file_path)
+        return probe["artist"], probe["album"]
+
+    def read_tags(self, audio):
+        try:
+            if audio is None:
+                return "Unknown Artist", "Unknown Album"
+
+            artist = audio.get("TPE1") or audio.get("artist")
+            artist = clean_tag(artist[0] if artist else None, "Unknown Artist")
+
+            album = audio.get("TALB") or audio.get("album")
+            album = clean_tag(album[0] if album else None, "Unknown Album")
+
+            return artist, album
+        except Exception as e:
+            self.log(f"Error reading metadata tags: {e}")
+            logging.error(f"Error reading metadata tags: {e}", exc_info=True)
+            return "Unknown Artist", "Unknown Album"
+
+    def get_bit_depth(self, file_path):
+        return self.probe_file(file_path)["bit_depth"]
+
+    def check_ffprobe(self):
+        # Only checked once per session instead of once per file
+        if self.ffprobe_available is None:
+            try:
+                subprocess.run(["ffprobe", "-version"], check=True, capture_output=True)
+                self.ffprobe_available = True
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                self.log("Error: 'ffprobe' command not found. Please ensure FFmpeg (which includes ffprobe) is installed and in your system's PATH.")
+                logging.error("Error: 'ffprobe' command not found. FFmpeg might not be installed or in PATH.", exc_info=True)
+                self.ffprobe_available = False
+        return self.ffprobe_available
+
+    def ffprobe_bit_depth(self, file_path):
+        """Returns (bit_depth, ok); ok is False when the 16-bit default was used because probing failed."""
+        try:
+            if not self.check_ffprobe():
+                return 16, False
+
+            cmd = [
+                "ffprobe",
+                "-v", "error",
+                "-select_streams", "a:0",
+                "-show_entries", "stream=bits_per_raw_sample",
+                "-of", "default=noprint_wrappers=1:nokey=1",
+                str(file_path)
+            ]
+            
+            logging.debug(f"FFprobe command for bit depth: {' '.join(cmd)}")
+            result = subprocess.run(
+                cmd,
+                capture_output=True,
+                text=True,
+                check=True
+            )
+            
+            bit_depth_str = result.stdout.strip()
+            logging.debug(f"FFprobe raw output for bit depth: '{bit_depth_str}'")
+
+            if bit_depth_str.isdigit():
+                bit_depth = int(bit_depth_str)
+                self.log(f"Debug: {file_path.name} - Detected bit depth: {bit_depth}-bit")
+                if bit_depth > 16:
+                    return 24, True
+                else:
+                    return 16, True
+            else:
+                self.log(f"Could not parse numeric bit depth from FFprobe output for {file_path.name}: '{bit_depth_str}'. Assuming 16-bit.")
+                logging.warning(f"Could not parse numeric bit depth from FFprobe output for {file_path.name}: '{bit_depth_str}'. Assuming 16-bit.")
+                return 16, True
+
+        except subprocess.CalledProcessError as e:
+            self.log(f"FFprobe failed for {file_path.name}. Stderr: {e.stderr.strip()}")
+            logging.error(f"FFprobe failed for {file_path.name}. Stderr: {e.stderr.strip()}", exc_info=True)
+            return 16, False
+        except Exception as e:
+            self.log(f"Unexpected error checking bit depth with FFprobe for {file_path.name}: {e}")
+            logging.error(f"Unexpected error checking bit depth with FFprobe for {file_path.name}: {e}", exc_info=True)
+            return 16, False
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# Reproducible throughput benchmark for audio_engine.py
+#
+# Builds a synthetic library offline with ffmpeg's lavfi sources (16/44.1, 24/96 and 24/192
+# FLAC with and without embedded art, plus MP3s, nested Artist/Album directories), then times
+# discovery, probing, FLAC-16 conversion and MP3 conversion separately at several worker counts.
+# Results are written as JSON; pass --compare with an older result file to flag regressions.
+#
+#   ./benchmarks/run_benchmarks.py --workers 1,2,4 --output bench-2.0.json
+#   ./benchmarks/run_benchmarks.py --compare bench-1.9.json --output bench-2.0.json
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import audio_engine  # noqa: E402
+from audio_engine import (  # noqa: E402
+    PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_VERSION,
+    ConversionEngine, ConversionOptions, StatCache, discover_audio_files, setup_logging,
+)
+
+RESULT_VERSION = 1
+
+# (name, codec arguments, sample rate, file extension)
+TRACK_FORMATS = [
+    ("16-44", ["-c:a", "flac", "-sample_fmt", "s16"], 44100, "flac"),
+    ("24-96", ["-c:a", "flac", "-sample_fmt", "s32", "-bits_per_raw_sample", "24"], 96000, "flac"),
+    ("24-192", ["-c:a", "flac", "-sample_fmt", "s32", "-bits_per_raw_sample", "24"], 192000, "flac"),
+    ("mp3", ["-c:a", "libmp3lame", "-b:a", "320k"], 44100, "mp3"),
+]
+
+def run_quiet(cmd):
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed:\n{result.stderr}")
+    return result
+
+def isolate_engine_state(work_dir):
+    """Keep journals, timing records and the measured encode speed in work_dir.
+
+    Real runs on synthetic sine tones must not overwrite the encode speed plan() uses for its
+    estimates, or fill the user's ~/.audio_converter_cache and timing logs.
+    """
+    audio_engine.CACHE_DIR = work_dir / "cache"
+    audio_engine.JOURNAL_DIR = audio_engine.CACHE_DIR / "journals"
+    audio_engine.ENCODE_SPEED_FILE = audio_engine.CACHE_DIR / "encode_speed.json"
+    audio_engine.TIMINGS_DIR = work_dir / "timings"
+
+def generate_library(library_dir, albums_per_format, tracks_per_album, track_seconds):
+    """Create Artist/Album/track files for every format, half of the albums with cover art."""
+    library_dir.mkdir(parents=True, exist_ok=True)
+    cover = library_dir / "cover-source.jpg"
+    if not cover.exists():
+        run_quiet(["ffmpeg", "-nostdin", "-y", "-f", "lavfi", "-i", "testsrc=size=600x600",
+                   "-frames:v", "1", str(cover)])
+    files = 0
+    for name, codec_args, sample_rate, extension in TRACK_FORMATS:
+        for album in range(albums_per_format):
+            with_art = album % 2 == 0
+            album_dir = library_dir / f"Artist {name}" / f"Album {album + 1}{' (art)' if with_art else ''}"
+            album_dir.mkdir(parents=True, exist_ok=True)
+            for track in range(tracks_per_album):
+                output = album_dir / f"{track + 1:02d} Track.{extension}"
+                if output.exists():
+                    files += 1
+                    continue
+                cmd = [
+                    "ffmpeg", "-nostdin", "-y", "-f", "lavfi",
+                    "-i", f"sine=frequency={220 * (track + 1)}:sample_rate={sample_rate}:duration={track_seconds}",
+                ]
+                if with_art:
+                    cmd += ["-i", str(cover), "-map", "0:a", "-map", "1:v", "-c:v", "copy",
+                            "-disposition:v", "attached_pic"]
+                cmd += ["-ac", "2"] + codec_args + [
+                    "-metadata", f"artist=Artist {name}",
+                    "-metadata", f"album=Album {album + 1}",
+                    "-metadata", f"title=Track {track + 1}",
+                    str(output),
+                ]
+                run_quiet(cmd)
+                files += 1
+    return files
+
+def time_discovery(library_dir, repeats):
+    timings = []
+    count = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        count = sum(1 for _ in discover_audio_files(library_dir, True))
+        timings.append(time.perf_counter() - start)
+    return {"files": count, "seconds": min(timings), "runs": timings}
+
+def time_probe(library_dir, work_dir):
+    """Time get_bit_depth + get_metadata over the library with a cold and then a warm probe cache."""
+    files = list(discover_audio_files(library_dir, True))
+    cache = StatCache(work_dir / "probe_cache.json", PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_VERSION)
+    cache.clear()
+    engine = ConversionEngine(ConversionOptions(directory=library_dir), probe_cache=cache)
+    result = {"files": len(files)}
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        for file_path in files:
+            engine.get_bit_depth(file_path)
+            engine.get_metadata(file_path)
+        seconds = time.perf_counter() - start
+        result[label] = {"seconds": seconds, "files_per_second": len(files) / seconds if seconds else None}
+    cache.save()
+    return result
+
+def warm_caches(library_dir, work_dir):
+    """Probe and hash every file into the saved probe cache before any conversion is timed.
+
+    Otherwise the first conversion run (the lowest worker count) pays for the probing and the
+    duplicate-detection hashing that every later run gets from the cache.
+    """
+    files = list(discover_audio_files(library_dir, True))
+    cache = StatCache(work_dir / "probe_cache.json", PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_VERSION)
+    engine = ConversionEngine(ConversionOptions(directory=library_dir), probe_cache=cache)
+    start = time.perf_counter()
+    for file_path in files:
+        engine.probe_file(file_path)
+        engine.job_signature(file_path)
+    cache.save()
+    return {"files": len(files), "seconds": time.perf_counter() - start}
+
+def time_conversion(library_dir, work_dir, output_format, workers):
+    output_dir = work_dir / f"out-{output_format}-{workers}"
+    shutil.rmtree(output_dir, ignore_errors=True)
+    cache = StatCache(work_dir / "probe_cache.json", PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_VERSION)
+    options = ConversionOptions(
+        directory=library_dir,
+        output_format=output_format,
+        recursive=True,
+        output_subdir=str(output_dir),
+        workers=workers,
+    )
+    engine = ConversionEngine(options, probe_cache=cache)
+    start = time.perf_counter()
+    results = engine.run()
+    seconds = time.perf_counter() - start
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return {
+        "workers": workers,
+        "probe_cache": "warm",
+        "seconds": seconds,
+        "audio_seconds": engine.audio_done,
+        "realtime_x": engine.audio_done / seconds if seconds else None,
+        **results,
+    }
+
+def environment_info():
+    info = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        info["ffmpeg"] = run_quiet(["ffmpeg", "-version"]).stdout.splitlines()[0]
+    except (OSError, RuntimeError):
+        info["ffmpeg"] = None
+    try:
+        info["git_commit"] = run_quiet(["git", "-C", str(REPO_DIR), "rev-parse", "--short", "HEAD"]).stdout.strip()
+    except (OSError, RuntimeError):
+        info["git_commit"] = None
+    return info
+
+def collect_timings(results):
+    """Flatten a result file into {stage name: seconds} for comparisons."""
+    timings = {
+        "discovery": results["discovery"]["seconds"],
+        "probe_cold": results["probe"]["cold"]["seconds"],
+        "probe_warm": results["probe"]["warm"]["seconds"],
+    }
+    if "cache_warmup" in results:
+        timings["cache_warmup"] = results["cache_warmup"]["seconds"]
+    for stage in ("convert_flac16", "convert_mp3"):
+        for run in results.get(stage, []):
+            timings[f"{stage}_w{run['workers']}"] = run["seconds"]
+    return timings
+
+def compare_results(previous, current, threshold):
+    """Print per-stage ratios; returns the stages that got slower by more than threshold."""
+    old_timings = collect_timings(previous)
+    new_timings = collect_timings(current)
+    regressions = []
+    print(f"{'stage':<24}{'before':>10}{'after':>10}{'ratio':>8}")
+    for stage, new_seconds in new_timings.items():
+        old_seconds = old_timings.get(stage)
+        if not old_seconds:
+            continue
+        ratio = new_seconds / old_seconds
+        flag = "  REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{stage:<24}{old_seconds:>10.3f}{new_seconds:>10.3f}{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(stage)
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scan, probe and encode throughput.")
+    parser.add_argument("--library", type=Path, help="where to build (or reuse) the synthetic library; default: a temp dir")
+    parser.add_argument("--albums", type=int, default=2, help="albums per format (default: 2)")
+    parser.add_argument("--tracks", type=int, default=4, help="tracks per album (default: 4)")
+    parser.add_argument("--track-seconds", type=int, default=30, help="length of each track (default: 30)")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="comma separated worker counts")
+    parser.add_argument("--repeats", type=int, default=3, help="discovery repetitions, best is kept (default: 3)")
+    parser.add_argument("--skip-encode", action="store_true", help="only time discovery and probing")
+    parser.add_argument("--output", type=Path, default=Path("benchmark-results.json"), help="result file to write")
+    parser.add_argument("--compare", type=Path, help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown counted as a regression (default: 0.10)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    worker_counts = sorted({max(1, int(w)) for w in args.workers.split(",") if w.strip()})
+    # Engine logging goes next to the results instead of into the user's ~/.audio_converter_logs
+    setup_logging(args.output.with_suffix(".log"))
+
+    with tempfile.TemporaryDirectory(prefix="audio_converter_bench_") as temp_dir:
+        work_dir = Path(temp_dir)
+        isolate_engine_state(work_dir)
+        library_dir = args.library or work_dir / "library"
+
+        print(f"Generating library in {library_dir} ...", flush=True)
+        start = time.perf_counter()
+        file_count = generate_library(library_dir, args.albums, args.tracks, args.track_seconds)
+        print(f"  {file_count} files in {time.perf_counter() - start:.1f}s", flush=True)
+
+        results = {
+            "result_version": RESULT_VERSION,
+            "environment": environment_info(),
+            "library": {
+                "files": file_count,
+                "albums_per_format": args.albums,
+                "tracks_per_album": args.tracks,
+                "track_seconds": args.track_seconds,
+                "formats": [name for name, _, _, _ in TRACK_FORMATS],
+            },
+        }
+
+        print("Timing discovery ...", flush=True)
+        results["discovery"] = time_discovery(library_dir, args.repeats)
+        print("Timing probe (cold and warm cache) ...", flush=True)
+        results["probe"] = time_probe(library_dir, work_dir)
+
+        if not args.skip_encode:
+            print("Warming the probe cache for the conversion runs ...", flush=True)
+            results["cache_warmup"] = warm_caches(library_dir, work_dir)
+            for output_format, stage in (("flac", "convert_flac16"), ("mp3", "convert_mp3")):
+                results[stage] = []
+                for workers in worker_counts:
+                    print(f"Timing {output_format} conversion with {workers} worker(s) ...", flush=True)
+                    results[stage].append(time_conversion(library_dir, work_dir, output_format, workers))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare_results(previous, results, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
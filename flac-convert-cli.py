@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Headless front end for audio_engine.py - same options as the GUI, no tkinter needed.
+# Progress is written to stdout as JSON lines, one event per line, e.g.
+#   {"event": "progress", "finished": 3, "total": 10, "scanning": true}
+# Exit status: 0 all files converted or skipped, 1 some files failed, 2 bad arguments, 130 stopped.
+
+import argparse
+import json
+import signal
+import sys
+import threading
+from pathlib import Path
+
+from audio_engine import (
+    DEFAULT_FSYNC_BATCH, DEFAULT_JOB_TIMEOUT, IONICE_CLASSES, SCHEDULES, WATCH_POLL_SECONDS, WATCH_SETTLE_SECONDS,
+    ConversionEngine, ConversionOptions, default_worker_count, setup_logging,
+)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch convert 24-bit FLAC files to 16-bit FLAC or MP3.")
+    parser.add_argument("directory", type=Path, help="source directory to scan")
+    parser.add_argument("--format", choices=("flac", "mp3"), default="flac", help="output format (default: flac)")
+    parser.add_argument("--bitrate", type=int, default=320, help="MP3 bitrate in kbps (default: 320)")
+    parser.add_argument("--recursive", action="store_true", help="scan subdirectories")
+    parser.add_argument("--delete-source", action="store_true", help="delete source files after conversion")
+    parser.add_argument("--delete-cue", action="store_true", help="delete matching .cue files")
+    parser.add_argument("--output-subdir", default="", help="output base directory (ignored with --delete-source)")
+    parser.add_argument("--workers", type=int, default=default_worker_count(), help="parallel ffmpeg jobs (default: CPU count)")
+    parser.add_argument("--staging-dir", default="", help="encode into a temp dir under DIR first, then copy to the target sequentially")
+    parser.add_argument("--write-workers", type=int, default=1, help="concurrent copies to the target when staging (default: 1)")
+    parser.add_argument("--fsync-batch", type=int, default=DEFAULT_FSYNC_BATCH,
+                        help=f"when staging, fsync after this many files; 0 = never, 1 = every file (default: {DEFAULT_FSYNC_BATCH})")
+    parser.add_argument("--schedule", choices=SCHEDULES, default="discovery",
+                        help="job order: as discovered (encoding starts during the walk), most expensive first,"
+                             " or albums kept together (default: discovery)")
+    parser.add_argument("--nice", type=int, default=0, help="CPU niceness 0-19 for each ffmpeg job (default: 0)")
+    parser.add_argument("--ionice", choices=sorted(IONICE_CLASSES), default="", help="disk priority class for each ffmpeg job")
+    parser.add_argument("--verify", action="store_true",
+                        help="decode-test each output and check its duration and layout; sources are only deleted after this")
+    parser.add_argument("--verify-workers", type=int, default=1, help="parallel verify jobs (default: 1)")
+    parser.add_argument("--job-timeout", type=float, default=DEFAULT_JOB_TIMEOUT,
+                        help=f"kill an ffmpeg job after this many seconds without progress; 0 = never (default: {DEFAULT_JOB_TIMEOUT:g})")
+    parser.add_argument("--watch", action="store_true", help="after converting, keep watching the directory and convert new files until stopped")
+    parser.add_argument("--watch-interval", type=float, default=WATCH_POLL_SECONDS,
+                        help=f"seconds between rescans in watch mode (default: {WATCH_POLL_SECONDS:g})")
+    parser.add_argument("--settle", type=float, default=WATCH_SETTLE_SECONDS,
+                        help=f"seconds a new file must stop growing before it is converted (default: {WATCH_SETTLE_SECONDS:g})")
+    parser.add_argument("--plan", action="store_true", help="only scan and probe; report what would be converted, sizes and time")
+    parser.add_argument("--no-dedupe", action="store_true", help="encode identical sources separately instead of reusing one encode")
+    args = parser.parse_args(argv)
+    if not args.directory.is_dir():
+        parser.error(f"not a directory: {args.directory}")
+    if not 0 <= args.nice <= 19:
+        parser.error("--nice must be between 0 and 19")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging()
+
+    options = ConversionOptions(
+        directory=args.directory,
+        output_format=args.format,
+        bitrate=args.bitrate,
+        recursive=args.recursive,
+        delete_source=args.delete_source,
+        delete_cue=args.delete_cue,
+        output_subdir=args.output_subdir,
+        workers=args.workers,
+        staging_dir=args.staging_dir,
+        write_workers=args.write_workers,
+        fsync_batch=args.fsync_batch,
+        deduplicate=not args.no_dedupe,
+        schedule=args.schedule,
+        nice=args.nice,
+        ionice_class=args.ionice,
+        job_timeout=args.job_timeout,
+        verify=args.verify,
+        verify_workers=args.verify_workers,
+    )
+
+    output_lock = threading.Lock()
+
+    def print_event(event):
+        with output_lock:
+            sys.stdout.write(json.dumps(event) + "\n")
+            sys.stdout.flush()
+
+    engine = ConversionEngine(options, on_event=print_event)
+
+    def request_stop(signum, frame):
+        # The handler runs on the main thread, possibly while it holds output_lock in print_event;
+        # stop() logs, so it must not run here. No I/O and no locks in the handler itself.
+        threading.Thread(target=engine.stop, daemon=True).start()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    if args.plan:
+        engine.plan()
+        return 130 if engine.stop_requested else 0
+
+    if args.watch:
+        engine.watch(poll_interval=args.watch_interval, settle_seconds=args.settle)
+        return 130 if engine.stop_requested else 0
+
+    results = engine.run()
+    if engine.stop_requested:
+        return 130
+    return 1 if results["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
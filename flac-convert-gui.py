@@ -9,26 +9,54 @@
 # v1.7 (Fix for 24-bit detection using ffprobe, improved error handling)
 # v1.8 (Log file path fixed for /usr/bin execution)
 # v1.9 - fixed issue to delete  cue file and fault identifying bit depth in conversions 
-VERSION = "1.9" # Updated version number
-DATE = "June 20, 2025" # Current date
+# v2.0 - parallel conversion with a configurable ffmpeg worker pool
+#        probe results (bit depth, sample rate, duration, tags) cached in ~/.audio_converter_cache
+#        FLAC headers parsed in-process, ffprobe only used as a fallback
+#        resumable runs: per-run job journal, outputs written to .part files and renamed into place
+#        MP3 artwork converted once per distinct picture instead of once per track
+#        conversion pipeline moved to audio_engine.py, headless runs via flac-convert-cli.py
+#        worker -> GUI updates go through a queue drained with root.after, on-screen log capped
+#        live per-file percent and speed, throughput and ETA weighted by audio duration
+#        "Stage Locally": encode to the temp dir, then copy to the target (iPod) sequentially
+#        "Reuse Duplicates": identical sources (FLAC audio MD5 + tags, or file hash) are encoded once
+#        "Plan": dry run with file counts, FLAC-16 vs MP3 size estimates and expected time
+#        "Job Order": as discovered, longest jobs first or albums kept together; "Low Priority" nice/ionice
+#        "Watch Folder": keep converting new albums as they finish arriving, until Stop
+#        Stop kills running ffmpeg process groups at once and removes partial outputs; stalled jobs time out
+#        "Verify Outputs": decode-test each output (duration, 16-bit/44.1k) before any source is deleted
+VERSION = "2.0" # Updated version number
+DATE = "October 17, 2026" # Current date
 
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog, scrolledtext
-import os
-import subprocess
 from pathlib import Path
-import shutil
+import tempfile
 import threading
-from mutagen import File
+import queue
+import time
 import logging
-from logging.handlers import RotatingFileHandler
+from audio_engine import (
+    CACHE_DIR, LOG_FILENAME, PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_VERSION, SCHEDULES, VERIFY_CACHE_MAX_ENTRIES,
+    VERIFY_CACHE_VERSION,
+    ConversionEngine, ConversionOptions, StatCache, default_worker_count, setup_logging,
+)
+
+UI_POLL_MS = 100 # how often queued engine events are applied to the widgets
+UI_MAX_EVENTS_PER_POLL = 5000 # leave the rest for the next poll so the Tk loop never stalls
+MAX_LOG_LINES = 2000 # the on-screen log keeps only this many lines; the log file has everything
+CLOSE_WAIT_SECONDS = 3 # Close waits this long for a stopped run to clean up before quitting
+LOW_PRIORITY_NICE = 10 # "Low Priority" runs ffmpeg at this niceness and idle disk priority
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
 
 class AudioConverterApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Audio Converter")
-        self.root.geometry("650x650") 
+        self.root.geometry("650x740") 
 
         # Default directory to user's Music/Downloads or just home if those don't exist
         default_dir = Path.home() / "Music"
@@ -44,36 +72,32 @@ class AudioConverterApp:
         self.delete_cue = tk.BooleanVar(value=False)
         self.bitrate = tk.IntVar(value=320)
         self.output_subdir = tk.StringVar(value="")
+        self.workers = tk.IntVar(value=default_worker_count())
+        self.stage_locally = tk.BooleanVar(value=False)
+        self.deduplicate = tk.BooleanVar(value=True)
+        self.schedule = tk.StringVar(value=SCHEDULES[0])
+        self.low_priority = tk.BooleanVar(value=False)
+        self.watch_folder = tk.BooleanVar(value=False)
+        self.verify = tk.BooleanVar(value=False)
 
         self.running = False
         self.conversion_thread = None
-        self.process = None
+        self.engine = None
+        self.ui_queue = queue.Queue()
+        self.active_files = {}
 
-        # --- MODIFICATION HERE: Set log file to a user-writable path ---
-        # Create a hidden directory for logs within the user's home directory
-        self.log_dir = Path.home() / ".audio_converter_logs"
-        self.log_dir.mkdir(parents=True, exist_ok=True) # Ensure the directory exists
-        self.log_filename = self.log_dir / "audio_converter.log"
-        # --- END MODIFICATION ---
+        # Logs live in ~/.audio_converter_logs so the app also works when run from /usr/bin
+        self.log_filename = LOG_FILENAME
+        setup_logging(self.log_filename)
 
-        self.setup_logging()
+        # Kept across runs so the engine does not reload it from disk every time
+        self.probe_cache = StatCache(CACHE_DIR / "probe_cache.json", PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_VERSION)
+        self.verify_cache = StatCache(CACHE_DIR / "verify_cache.json", VERIFY_CACHE_MAX_ENTRIES, VERIFY_CACHE_VERSION)
 
         self.create_widgets()
-        self.root.grid_rowconfigure(6, weight=1)
+        self.root.grid_rowconfigure(7, weight=1)
         self.root.grid_columnconfigure(1, weight=1)
-
-    def setup_logging(self):
-        log_handler = RotatingFileHandler(
-            str(self.log_filename), # Use str() as RotatingFileHandler might not accept Path objects
-            maxBytes=10 * 1024 * 1024,
-            backupCount=5,
-        )
-        log_format = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        log_handler.setFormatter(log_format)
-
-        for handler in logging.root.handlers[:]:
-            logging.root.removeHandler(handler)
-        logging.basicConfig(level=logging.DEBUG, handlers=[log_handler])
+        self.root.after(UI_POLL_MS, self.drain_ui_queue)
 
     def create_widgets(self):
         ttk.Label(self.root, text="Source Directory:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
@@ -96,6 +120,7 @@ class AudioConverterApp:
         self.format.trace("w", self.update_bitrate_state)
         self.update_bitrate_state()
 
+        ttk.Checkbutton(self.root, text="Stage Locally", variable=self.stage_locally).grid(row=3, column=0, padx=5, pady=5, sticky="w")
         ttk.Checkbutton(self.root, text="Recursive", variable=self.recursive).grid(row=3, column=1, pady=5, sticky="w")
         self.delete_source_checkbox = ttk.Checkbutton(self.root, text="Delete Source Files", variable=self.delete_source)
         self.delete_source_checkbox.grid(row=3, column=2, pady=5, sticky="w")
@@ -104,30 +129,61 @@ class AudioConverterApp:
         ttk.Checkbutton(self.root, text="Delete .cue Files", variable=self.delete_cue).grid(row=3, column=3, pady=5, sticky="w")
         self.update_output_subdir_state()
 
+        workers_frame = ttk.Frame(self.root)
+        workers_frame.grid(row=3, column=4, padx=5, pady=5, sticky="w")
+        ttk.Label(workers_frame, text="Workers:").pack(side="left")
+        self.workers_spinbox = ttk.Spinbox(workers_frame, from_=1, to_=max(32, default_worker_count()), increment=1, textvariable=self.workers, width=3)
+        self.workers_spinbox.pack(side="left")
+
+        ttk.Checkbutton(self.root, text="Reuse Duplicates", variable=self.deduplicate).grid(row=4, column=0, padx=5, pady=5, sticky="w")
+        schedule_frame = ttk.Frame(self.root)
+        schedule_frame.grid(row=4, column=1, pady=5, sticky="w")
+        ttk.Label(schedule_frame, text="Job Order:").pack(side="left")
+        ttk.Combobox(schedule_frame, textvariable=self.schedule, values=SCHEDULES, state="readonly", width=9).pack(side="left")
+        ttk.Checkbutton(self.root, text="Low Priority", variable=self.low_priority).grid(row=4, column=2, pady=5, sticky="w")
+        ttk.Checkbutton(self.root, text="Watch Folder", variable=self.watch_folder).grid(row=4, column=3, pady=5, sticky="w")
+        ttk.Checkbutton(self.root, text="Verify Outputs", variable=self.verify).grid(row=4, column=4, padx=5, pady=5, sticky="w")
+
         self.start_button = ttk.Button(self.root, text="Start Conversion", command=self.start_conversion)
-        self.start_button.grid(row=4, column=1, pady=10)
+        self.start_button.grid(row=5, column=1, pady=10)
 
         self.stop_button = ttk.Button(self.root, text="Stop", command=self.stop_conversion, state="disabled")
-        self.stop_button.grid(row=4, column=2, pady=10)
+        self.stop_button.grid(row=5, column=2, pady=10)
 
-        self.progress = ttk.Progressbar(self.root, length=500, mode="determinate")
-        self.progress.grid(row=5, column=0, columnspan=5, padx=5, pady=5, sticky="ew")
+        self.progress_label = ttk.Label(self.root, text="")
+        self.progress_label.grid(row=5, column=3, columnspan=2, padx=5, pady=10, sticky="w")
+
+        progress_frame = ttk.Frame(self.root)
+        progress_frame.grid(row=6, column=0, columnspan=5, padx=5, pady=5, sticky="ew")
+        progress_frame.grid_columnconfigure(0, weight=1)
+        self.progress = ttk.Progressbar(progress_frame, length=500, mode="determinate")
+        self.progress.grid(row=0, column=0, sticky="ew")
+        self.throughput_label = ttk.Label(progress_frame, text="")
+        self.throughput_label.grid(row=1, column=0, sticky="w")
+        self.file_progress_label = ttk.Label(progress_frame, text="", wraplength=620)
+        self.file_progress_label.grid(row=2, column=0, sticky="w")
 
         self.status_text = scrolledtext.ScrolledText(self.root, width=70, height=15)
-        self.status_text.grid(row=6, column=0, columnspan=5, padx=5, pady=5, sticky="nsew")
+        self.status_text.grid(row=7, column=0, columnspan=5, padx=5, pady=5, sticky="nsew")
+
+        self.plan_button = ttk.Button(self.root, text="Plan", command=self.start_plan)
+        self.plan_button.grid(row=5, column=0, pady=10)
 
         self.close_button = ttk.Button(self.root, text="Close", command=self.close_app)
-        self.close_button.grid(row=7, column=1, pady=10)
+        self.close_button.grid(row=8, column=1, pady=10)
 
         self.clear_log_button = ttk.Button(self.root, text="Clear Log", command=self.clear_log)
-        self.clear_log_button.grid(row=7, column=2, pady=10)
+        self.clear_log_button.grid(row=8, column=2, pady=10)
+
+        self.clear_cache_button = ttk.Button(self.root, text="Clear Cache", command=self.clear_cache)
+        self.clear_cache_button.grid(row=8, column=3, pady=10)
 
         # Log file path label now points to the user's home directory log file
         self.log_path_label = ttk.Label(self.root, text=f"Log File: {self.log_filename.resolve()}")
-        self.log_path_label.grid(row=8, column=0, columnspan=5, pady=5, sticky="w")
+        self.log_path_label.grid(row=9, column=0, columnspan=5, pady=5, sticky="w")
 
         version_info = f"Version: {VERSION} ({DATE})"
-        ttk.Label(self.root, text=version_info).grid(row=9, column=0, columnspan=5, pady=5, sticky="ew")
+        ttk.Label(self.root, text=version_info).grid(row=10, column=0, columnspan=5, pady=5, sticky="ew")
 
     def browse_directory(self):
         folder_selected = filedialog.askdirectory()
@@ -148,284 +204,165 @@ class AudioConverterApp:
             self.output_subdir_browse_button["state"] = "normal"
 
     def start_conversion(self):
+        # With "Watch Folder" the thread keeps converting new arrivals until Stop is pressed
+        self.start_engine_thread(self.run_watch if self.watch_folder.get() else self.run_conversion)
+
+    def start_plan(self):
+        self.start_engine_thread(self.run_plan)
+
+    def start_engine_thread(self, target):
         if self.running:
             self.log("Conversion already in progress.")
             return
         self.running = True
         self.start_button["state"] = "disabled"
+        self.plan_button["state"] = "disabled"
         self.stop_button["state"] = "normal"
-        self.conversion_thread = threading.Thread(target=self.run_conversion, daemon=True)
+        # Tk variables are read here on the main thread; the worker thread only sees plain options.
+        # The engine is created here too, so Stop always has one to cancel.
+        self.engine = ConversionEngine(
+            self.get_options(), on_event=self.ui_queue.put, probe_cache=self.probe_cache, verify_cache=self.verify_cache
+        )
+        self.conversion_thread = threading.Thread(target=target, daemon=True)
         self.conversion_thread.start()
 
-    def run_conversion(self):
-        self.log("Starting conversion...")
-        directory = Path(self.directory.get())
-        output_format = self.format.get()
-        delete_source = self.delete_source.get()
-        delete_cue = self.delete_cue.get()
-        recursive = self.recursive.get()
-
-        if not directory.exists():
-            self.log("Invalid directory.")
-            self.cleanup()
-            return
+    def get_options(self):
+        return ConversionOptions(
+            directory=Path(self.directory.get()),
+            output_format=self.format.get(),
+            bitrate=self.bitrate.get(),
+            recursive=self.recursive.get(),
+            delete_source=self.delete_source.get(),
+            delete_cue=self.delete_cue.get(),
+            output_subdir=self.output_subdir.get(),
+            workers=self.get_worker_count(),
+            staging_dir=tempfile.gettempdir() if self.stage_locally.get() else "",
+            deduplicate=self.deduplicate.get(),
+            schedule=self.schedule.get(),
+            nice=LOW_PRIORITY_NICE if self.low_priority.get() else 0,
+            ionice_class="idle" if self.low_priority.get() else "",
+            verify=self.verify.get(),
+        )
 
-        files_to_convert = []
-        if recursive:
-            for root, _, files in os.walk(directory):
-                for file in files:
-                    if file.lower().endswith((".flac", ".mp3")):
-                        files_to_convert.append(Path(root) / file)
-        else:
-            for file in directory.iterdir():
-                if file.suffix.lower() in [".flac", ".mp3"]:
-                    files_to_convert.append(file)
+    def run_conversion(self):
+        # Runs on the worker thread: never touch widgets here, only self.ui_queue
+        try:
+            self.engine.run()
+        except Exception as e:
+            logging.error(f"Conversion thread failed: {e}", exc_info=True)
+            self.ui_queue.put({"event": "log", "message": f"Conversion failed: {e}"})
+        finally:
+            self.ui_queue.put({"event": "thread_finished"})
 
-        if not files_to_convert:
-            self.log("No audio files found.")
-            self.cleanup()
-            return
+    def run_watch(self):
+        try:
+            self.engine.watch()
+        except Exception as e:
+            logging.error(f"Watch thread failed: {e}", exc_info=True)
+            self.ui_queue.put({"event": "log", "message": f"Watching failed: {e}"})
+        finally:
+            self.ui_queue.put({"event": "thread_finished"})
 
-        total_files = len(files_to_convert)
-        logging.debug(f"Total files to convert: {total_files}")
-        for i, file_path in enumerate(files_to_convert):
-            logging.debug(f"Processing file {i + 1} of {total_files}: {file_path}")
-            if not self.running:
-                self.log("Conversion stopped by user.")
+    def run_plan(self):
+        # Dry run on the worker thread: same scan and probe, the estimate arrives as log lines
+        try:
+            self.engine.plan()
+        except Exception as e:
+            logging.error(f"Plan thread failed: {e}", exc_info=True)
+            self.ui_queue.put({"event": "log", "message": f"Plan failed: {e}"})
+        finally:
+            self.ui_queue.put({"event": "thread_finished"})
+
+    def drain_ui_queue(self):
+        # Merge everything queued since the last poll into one text insert and one progress update
+        messages = []
+        progress = None
+        finished = False
+        for _ in range(UI_MAX_EVENTS_PER_POLL):
+            try:
+                event = self.ui_queue.get_nowait()
+            except queue.Empty:
                 break
-            self.progress['value'] = (i + 1) / total_files * 100
-            self.root.update_idletasks()
-            
-            self.convert_audio(file_path, output_format, delete_source, directory)
-
-            if delete_cue:
-                cue_file_path = file_path.with_suffix('.cue')
-                if cue_file_path.exists():
-                    try:
-                        os.remove(cue_file_path)
-                        self.log(f"Deleted CUE file: {cue_file_path.name}")
-                        logging.info(f"Deleted CUE file: {cue_file_path}")
-                    except OSError as e:
-                        self.log(f"Error deleting CUE file {cue_file_path.name}: {e}")
-                        logging.error(f"Error deleting CUE file {cue_file_path}: {e}")
-                else:
-                    logging.debug(f"No .cue file found for {file_path.name} in the same directory.")
-
+            if event["event"] == "log":
+                messages.append(event["message"])
+            elif event["event"] == "progress":
+                progress = event
+            elif event["event"] == "file_progress":
+                self.active_files[event["path"]] = event
+            elif event["event"] == "file":
+                self.active_files.pop(event["path"], None)
+            elif event["event"] == "thread_finished":
+                finished = True
+
+        if messages:
+            self.show_message("\n".join(messages))
+        if progress is not None and self.running and not self.engine.stop_requested:
+            self.update_progress(progress)
         if self.running:
-            self.log("Conversion completed.")
-        self.cleanup()
-
-    def convert_audio(self, file_path, output_format, delete_source, target_dir):
-        if not self.running:
-            return
-
-        if output_format == "flac":
-            source_bit_depth = self.get_bit_depth(file_path)
-            if source_bit_depth == 16:
-                self.log(f"Skipping {file_path.name} (already 16-bit FLAC)")
-                return
-
-        artist, album = self.get_metadata(file_path)
-        if delete_source:
-            output_dir = file_path.parent
-        else:
-            base_output_path = Path(self.output_subdir.get()) if self.output_subdir.get() else target_dir
-            sanitized_artist = "".join(c for c in artist if c.isalnum() or c in (' ', '.', '_', '-')).strip()
-            sanitized_album = "".join(c for c in album if c.isalnum() or c in (' ', '.', '_', '-')).strip()
-            
-            suffix = "MP3" if output_format == "mp3" else "16bit"
-            output_dir = base_output_path / f"{sanitized_artist} - {sanitized_album} {suffix}"
-            output_dir.mkdir(parents=True, exist_ok=True)
+            self.update_file_progress()
+        if finished:
+            self.cleanup()
+        self.root.after(UI_POLL_MS, self.drain_ui_queue)
+
+    def update_progress(self, progress):
+        # The bar follows seconds of audio encoded, so a 40 minute track weighs more than a 2 minute one.
+        # total files and total audio keep growing while discovery is still running.
+        if progress["audio_total"]:
+            self.progress['value'] = progress["audio_processed"] / progress["audio_total"] * 100
+        elif progress["total"]:
+            self.progress['value'] = progress["finished"] / progress["total"] * 100
+        scan_note = " (scanning...)" if progress["scanning"] else ""
+        self.progress_label["text"] = f"{progress['finished']} / {progress['total']} files{scan_note}"
+
+        eta = format_duration(progress["eta"]) if progress["eta"] is not None else "--"
+        self.throughput_label["text"] = (
+            f"Audio: {format_duration(progress['audio_processed'])} / {format_duration(progress['audio_total'])}"
+            f"   Throughput: {progress['throughput']:.1f} audio-h/h   ETA: {eta}"
+        )
 
-        output_file_name = file_path.stem + f".{output_format}"
-        output_file = output_dir / output_file_name
+    def update_file_progress(self):
+        parts = []
+        for path, event in self.active_files.items():
+            percent = f"{event['percent']:.0f}%" if event["percent"] is not None else "?"
+            speed = f" @ {event['speed']:.1f}x" if event["speed"] is not None else ""
+            parts.append(f"{Path(path).name} {percent}{speed}")
+        self.file_progress_label["text"] = "   |   ".join(parts)
 
+    def get_worker_count(self):
         try:
-            if output_format == "flac":
-                cmd = [
-                    "ffmpeg", "-i", str(file_path),
-                    "-map", "0:a",
-                    "-map_metadata", "0",
-                    "-c:a", "flac",
-                    "-sample_fmt", "s16", "-ar", "44100",
-                    str(output_file)
-                ]
-                self.log(f"Converting {file_path.name} to 16-bit FLAC...")
-                logging.debug(f"FFmpeg command: {' '.join(cmd)}")
-                self.process = subprocess.run(cmd, capture_output=True, text=True)
-                logging.debug(f"FFmpeg return code: {self.process.returncode}")
-                if self.process.returncode != 0:
-                    logging.error(f"FFmpeg error: {self.process.stderr}")
-                    self.log(f"Failed to convert {file_path.name}:")
-                    self.log(self.process.stderr)
-                    return
-
-            elif output_format == "mp3":
-                selected_bitrate = f"{self.bitrate.get()}k"
-                artwork_filename = "cover.jpg"
-                artwork = output_dir / artwork_filename
-                has_artwork = False
-
-                artwork_cmd = ["ffmpeg", "-i", str(file_path), "-an", "-vcodec", "mjpeg",
-                                 "-vf", "format=yuv420p", "-f", "image2", str(artwork)]
-                logging.debug(f"Artwork extraction command: {' '.join(artwork_cmd)}")
-                artwork_result = subprocess.run(artwork_cmd, capture_output=True, text=True)
-                logging.debug(f"Artwork extraction return code: {artwork_result.returncode}")
-                logging.debug(f"Artwork extraction stderr: {artwork_result.stderr}")
-
-                if artwork_result.returncode == 0 and artwork.exists() and artwork.stat().st_size > 0:
-                    has_artwork = True
-                    logging.debug(f"Artwork extracted successfully: {artwork}")
-                else:
-                    self.log(f"No artwork or failed to extract artwork for {file_path.name}. Output: {artwork_result.stderr.strip()}")
-                    logging.warning(f"No artwork or failed to extract artwork for {file_path.name}. Output: {artwork_result.stderr.strip()}")
-
-                cmd = ["ffmpeg", "-i", str(file_path)]
-                if has_artwork:
-                    cmd.extend(["-i", str(artwork)])
-                cmd.extend(["-map", "0:a"])
-                if has_artwork:
-                    cmd.extend(["-map", "1:v"])
-                cmd.extend([
-                    "-b:a", selected_bitrate, "-ar", "44100", "-ac", "2",
-                    "-map_metadata", "0", "-id3v2_version", "3", "-write_id3v1", "1",
-                    str(output_file)
-                ])
-
-                self.log(f"Converting {file_path.name} to MP3 ({selected_bitrate})...")
-                logging.debug(f"MP3 conversion command: {' '.join(cmd)}")
-                self.process = subprocess.run(cmd, capture_output=True, text=True)
-                logging.debug(f"MP3 conversion return code: {self.process.returncode}")
-                logging.debug(f"MP3 conversion stderr: {self.process.stderr}")
-
-                if self.process.returncode != 0:
-                    logging.error(f"FFmpeg error: {self.process.stderr}")
-                    self.log(f"Failed to convert {file_path.name} to MP3:")
-                    self.log(self.process.stderr)
-                    return
-                if has_artwork and artwork.exists():
-                    try:
-                        os.remove(artwork)
-                        logging.debug(f"Deleted temporary artwork file: {artwork}")
-                    except OSError as e:
-                        logging.error(f"Error deleting temporary artwork file {artwork}: {e}")
-
-            if delete_source:
-                try:
-                    os.remove(file_path)
-                    self.log(f"Deleted source file: {file_path.name}")
-                    logging.info(f"Deleted source file: {file_path}")
-                except OSError as e:
-                    self.log(f"Error deleting source file {file_path.name}: {e}")
-                    logging.error(f"Error deleting source file {file_path}: {e}")
-
-        except Exception as e:
-            self.log(f"Unexpected error converting {file_path.name}: {e}")
-            logging.error(f"Unexpected error converting {file_path.name}: {e}", exc_info=True)
+            return max(1, int(self.workers.get()))
+        except (tk.TclError, ValueError):
+            return default_worker_count()
 
     def stop_conversion(self):
-        if self.running:
-            self.running = False
-            self.log("Stopping conversion...")
-            if self.process and self.process.poll() is None:
-                try:
-                    self.process.terminate()
-                    self.process.wait(timeout=2)
-                    self.log("Terminated current process.")
-                except subprocess.TimeoutExpired:
-                    self.process.kill()
-                    self.log("Forced kill of process.")
-            if self.conversion_thread and self.conversion_thread.is_alive():
-                self.conversion_thread.join(timeout=5)
-                if self.conversion_thread.is_alive():
-                    self.log("Warning: Conversion thread did not terminate cleanly.")
-            self.cleanup()
+        # Never waits on the Tk thread: the engine kills its ffmpeg jobs and removes their partial
+        # outputs, and cleanup() runs when the worker thread reports thread_finished
+        if self.running and self.engine:
+            self.engine.stop()
+            self.stop_button["state"] = "disabled"
+            self.progress_label["text"] = "Stopping..."
 
     def cleanup(self):
         self.progress['value'] = 0
+        self.progress_label["text"] = ""
+        self.throughput_label["text"] = ""
+        self.file_progress_label["text"] = ""
+        self.active_files = {}
         self.start_button["state"] = "normal"
+        self.plan_button["state"] = "normal"
         self.stop_button["state"] = "disabled"
         self.running = False
-        self.process = None
-        self.root.update()
 
     def log(self, message):
-        self.status_text.insert(tk.END, message + "\n")
-        self.status_text.yview(tk.END)
+        self.show_message(message)
         logging.info(message)
 
-    def get_metadata(self, file_path):
-        try:
-            audio = File(file_path)
-            if audio is None:
-                return "Unknown Artist", "Unknown Album"
-
-            artist = audio.get("TPE1") or audio.get("artist")
-            artist = str(artist[0]) if artist and artist[0] else "Unknown Artist"
-
-            album = audio.get("TALB") or audio.get("album")
-            album = str(album[0]) if album and album[0] else "Unknown Album"
-
-            invalid_chars = '<>:"/\\|?*'
-            for char in invalid_chars:
-                artist = artist.replace(char, "")
-                album = album.replace(char, "")
-
-            return artist.strip(), album.strip()
-        except Exception as e:
-            self.log(f"Error reading metadata for {file_path.name}: {e}")
-            logging.error(f"Error reading metadata for {file_path.name}: {e}", exc_info=True)
-            return "Unknown Artist", "Unknown Album"
-
-    def get_bit_depth(self, file_path):
-        try:
-            try:
-                subprocess.run(["ffprobe", "-version"], check=True, capture_output=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                self.log("Error: 'ffprobe' command not found. Please ensure FFmpeg (which includes ffprobe) is installed and in your system's PATH.")
-                logging.error("Error: 'ffprobe' command not found. FFmpeg might not be installed or in PATH.", exc_info=True)
-                return 16
-
-            cmd = [
-                "ffprobe",
-                "-v", "error",
-                "-select_streams", "a:0",
-                "-show_entries", "stream=bits_per_raw_sample",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                str(file_path)
-            ]
-            
-            logging.debug(f"FFprobe command for bit depth: {' '.join(cmd)}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            bit_depth_str = result.stdout.strip()
-            logging.debug(f"FFprobe raw output for bit depth: '{bit_depth_str}'")
-
-            if bit_depth_str.isdigit():
-                bit_depth = int(bit_depth_str)
-                self.log(f"Debug: {file_path.name} - Detected bit depth: {bit_depth}-bit")
-                if bit_depth > 16:
-                    return 24
-                else:
-                    return 16
-            else:
-                self.log(f"Could not parse numeric bit depth from FFprobe output for {file_path.name}: '{bit_depth_str}'. Assuming 16-bit.")
-                logging.warning(f"Could not parse numeric bit depth from FFprobe output for {file_path.name}: '{bit_depth_str}'. Assuming 16-bit.")
-                return 16
-
-        except subprocess.CalledProcessError as e:
-            self.log(f"FFprobe failed for {file_path.name}. Stderr: {e.stderr.strip()}")
-            logging.error(f"FFprobe failed for {file_path.name}. Stderr: {e.stderr.strip()}", exc_info=True)
-            return 16
-        except Exception as e:
-            self.log(f"Unexpected error checking bit depth with FFprobe for {file_path.name}: {e}")
-            logging.error(f"Unexpected error checking bit depth with FFprobe for {file_path.name}: {e}", exc_info=True)
-            return 16
+    def show_message(self, message):
+        self.status_text.insert(tk.END, message + "\n")
+        line_count = int(self.status_text.index("end-1c").split(".")[0])
+        if line_count > MAX_LOG_LINES:
+            self.status_text.delete("1.0", f"{line_count - MAX_LOG_LINES}.0")
+        self.status_text.yview(tk.END)
 
     def update_bitrate_state(self, *args):
         if self.format.get() == "flac":
@@ -445,8 +382,24 @@ class AudioConverterApp:
             self.log(f"Error clearing log: {e}")
             logging.error(f"Error clearing log: {e}", exc_info=True)
 
+    def clear_cache(self):
+        if self.running:
+            self.log("Cannot clear the caches while a conversion is running.")
+            return
+        self.probe_cache.clear()
+        self.verify_cache.clear()
+        self.log(f"Probe cache cleared: {self.probe_cache.cache_file}")
+        self.log(f"Verify cache cleared: {self.verify_cache.cache_file}")
+
     def close_app(self):
         self.stop_conversion()
+        self.quit_when_stopped(time.monotonic() + CLOSE_WAIT_SECONDS)
+
+    def quit_when_stopped(self, deadline):
+        # Give the worker a moment to delete partial outputs, without blocking the event loop
+        if self.conversion_thread and self.conversion_thread.is_alive() and time.monotonic() < deadline:
+            self.root.after(UI_POLL_MS, self.quit_when_stopped, deadline)
+            return
         self.root.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Tests for the in-process FLAC header parser in audio_engine.py, which decides what gets skipped
+# and deleted. Files are crafted byte by byte and every answer is checked against mutagen.
+#
+#   python3 -m pytest tests
+#   python3 -m unittest discover tests
+
+import struct
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from mutagen.flac import FLAC, FLACNoHeaderError, error as FLACError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from audio_engine import iter_flac_blocks, read_flac_header, read_flac_picture  # noqa: E402
+
+AUDIO_MD5 = bytes(range(16))
+
+def streaminfo(sample_rate=96000, channels=2, bits_per_sample=24, total_samples=96000 * 3):
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits_per_sample - 1) << 36) | total_samples
+    # min/max block size, min/max frame size (0 = unknown), packed stream layout, audio MD5
+    return struct.pack(">HH", 4096, 4096) + bytes(6) + packed.to_bytes(8, "big") + AUDIO_MD5
+
+def vorbis_comment(comments, vendor=b"reference libFLAC"):
+    data = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for comment in comments:
+        data += struct.pack("<I", len(comment)) + comment
+    return data
+
+def picture(picture_type, image, mime=b"image/jpeg"):
+    return (struct.pack(">I", picture_type) + struct.pack(">I", len(mime)) + mime + struct.pack(">I", 0)
+            + struct.pack(">IIII", 1, 1, 24, 0) + struct.pack(">I", len(image)) + image)
+
+def metadata_block(block_type, data, last=False):
+    return bytes([(0x80 if last else 0) | block_type]) + len(data).to_bytes(3, "big") + data
+
+def flac_file(*blocks):
+    blocks = list(blocks)
+    blocks[-1] = bytes([blocks[-1][0] | 0x80]) + blocks[-1][1:]
+    # A frame sync code after the metadata, so the file also looks like a FLAC stream to mutagen
+    return b"fLaC" + b"".join(blocks) + b"\xff\xf8" + bytes(64)
+
+def id3v2_tag(size=20):
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b"ID3\x03\x00\x00" + syncsafe + bytes(size)
+
+TAGS = vorbis_comment([b"ARTIST=Some Artist", b"album=Some Album", b"TITLE=Track"])
+PLAIN = flac_file(metadata_block(0, streaminfo()), metadata_block(4, TAGS))
+
+class FlacHeaderTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def write(self, name, data):
+        path = Path(self.temp_dir.name) / name
+        path.write_bytes(data)
+        return path
+
+    def assert_matches_mutagen(self, path, header):
+        audio = FLAC(path)
+        self.assertEqual(header["bits_per_sample"], audio.info.bits_per_sample)
+        self.assertEqual(header["sample_rate"], audio.info.sample_rate)
+        self.assertEqual(header["channels"], audio.info.channels)
+        self.assertAlmostEqual(header["duration"], audio.info.length)
+        self.assertEqual(int(header["md5"], 16), audio.info.md5_signature)
+        self.assertEqual(header["artist"], (audio.get("artist") or [None])[0])
+        self.assertEqual(header["album"], (audio.get("album") or [None])[0])
+        self.assertEqual(header["has_picture"], bool(audio.pictures))
+
+    def test_plain_flac(self):
+        path = self.write("plain.flac", PLAIN)
+        header = read_flac_header(path)
+        self.assertEqual(header["bits_per_sample"], 24)
+        self.assertEqual(header["sample_rate"], 96000)
+        self.assertEqual(header["duration"], 3.0)
+        self.assertEqual(header["artist"], "Some Artist")
+        self.assert_matches_mutagen(path, header)
+
+    def test_16_bit_44k(self):
+        path = self.write("cd.flac", flac_file(
+            metadata_block(0, streaminfo(44100, 2, 16, 44100 * 200)), metadata_block(4, TAGS)
+        ))
+        header = read_flac_header(path)
+        self.assertEqual((header["bits_per_sample"], header["sample_rate"]), (16, 44100))
+        self.assert_matches_mutagen(path, header)
+
+    def test_id3_prefixed_flac(self):
+        path = self.write("id3.flac", id3v2_tag() + PLAIN)
+        header = read_flac_header(path)
+        self.assertEqual(header, read_flac_header(self.write("plain.flac", PLAIN)))
+        self.assert_matches_mutagen(path, header)
+
+    def test_truncated_vorbis_comment(self):
+        # The last comment claims more bytes than its block holds. mutagen reads on into the audio
+        # frames and returns a mangled title; the parser raises instead (probe_file catches
+        # struct.error and falls back) rather than return half-read tags.
+        path = self.write("truncated.flac", flac_file(metadata_block(0, streaminfo()), metadata_block(4, TAGS[:-3])))
+        with self.assertRaises(struct.error):
+            read_flac_header(path)
+        audio = FLAC(path)
+        self.assertEqual((audio["artist"], audio["album"]), (["Some Artist"], ["Some Album"]))
+        self.assertNotEqual(audio["title"], ["Track"])
+
+    def test_vorbis_comment_past_end_of_file(self):
+        path = self.write("cut.flac", b"fLaC" + metadata_block(0, streaminfo()) + metadata_block(4, TAGS, last=True)[:-3])
+        with self.assertRaises(struct.error):
+            read_flac_header(path)
+        with self.assertRaises(FLACError):
+            FLAC(path)
+
+    def test_truncated_comment_count(self):
+        path = self.write("no-count.flac", flac_file(metadata_block(0, streaminfo()), metadata_block(4, TAGS[:21])))
+        with self.assertRaises(struct.error):
+            read_flac_header(path)
+
+    def test_zero_sample_streaminfo(self):
+        # 0 total samples means "unknown" in STREAMINFO; like mutagen the duration is 0, which the
+        # engine treats as no duration (no ETA weight, no duration check when verifying)
+        path = self.write("zero.flac", flac_file(metadata_block(0, streaminfo(total_samples=0)), metadata_block(4, TAGS)))
+        header = read_flac_header(path)
+        self.assertEqual(header["duration"], 0.0)
+        self.assertEqual(header["bits_per_sample"], 24)
+        self.assert_matches_mutagen(path, header)
+
+    def test_short_streaminfo(self):
+        path = self.write("short.flac", flac_file(metadata_block(0, streaminfo()[:20])))
+        self.assertIsNone(read_flac_header(path))
+
+    def test_not_flac(self):
+        path = self.write("not.flac", b"RIFF" + bytes(100))
+        self.assertIsNone(read_flac_header(path))
+        with open(path, "rb") as f:
+            self.assertEqual(list(iter_flac_blocks(f)), [])
+        with self.assertRaises(FLACNoHeaderError):
+            FLAC(path)
+
+    def test_blocks_are_skipped_by_length(self):
+        padding = metadata_block(1, bytes(1000))
+        path = self.write("padded.flac", flac_file(metadata_block(0, streaminfo()), padding, metadata_block(4, TAGS)))
+        with open(path, "rb") as f:
+            self.assertEqual([block_type for block_type, _ in iter_flac_blocks(f)], [0, 1, 4])
+        self.assert_matches_mutagen(path, read_flac_header(path))
+
+    def test_front_cover_is_preferred(self):
+        path = self.write("art.flac", flac_file(
+            metadata_block(0, streaminfo()),
+            metadata_block(6, picture(0, b"other image")),
+            metadata_block(6, picture(3, b"front cover")),
+            metadata_block(4, TAGS),
+        ))
+        self.assertEqual(read_flac_picture(path), b"front cover")
+        self.assertEqual([p.data for p in FLAC(path).pictures if p.type == 3], [b"front cover"])
+        self.assert_matches_mutagen(path, read_flac_header(path))
+
+    def test_first_picture_without_front_cover(self):
+        path = self.write("art.flac", flac_file(metadata_block(0, streaminfo()), metadata_block(6, picture(8, b"artist photo"))))
+        self.assertEqual(read_flac_picture(path), b"artist photo")
+        self.assertIsNone(read_flac_picture(self.write("plain.flac", PLAIN)))
+
+if __name__ == "__main__":
+    unittest.main()